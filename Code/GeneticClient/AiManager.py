@@ -10,6 +10,10 @@ from ActionRuleClass import ActionRule
 import ActionRuleClass
 from scipy.special import softmax
 from publisher import Publisher
+from state_snapshot import StateSnapshot
+from rule_store import rng_states
+from concurrent.futures import ThreadPoolExecutor
+import threading
 
 # import pygad as pga
 # from pyharmonysearch import harmony_search
@@ -52,6 +56,8 @@ MUTATION_RATE_VALUES = 0.3 #How likely are individual cond_value entries to muta
 MUTATION_RATE_BITS = 0.05 #How likely are individual cond_bits to mutate
 NUM_FEATURES = ActionRuleClass.CONDITIONAL_ATTRIBUTE_COUNT
 PARENT_PERCENTAGE = 0.2 # how much of the population we want to sample from for parents to breed
+#run training_update on a background thread, the next scenario starts right away on the current generation
+ASYNC_TRAINING = True
 
 
 class AiManager:
@@ -71,15 +77,37 @@ class AiManager:
         # in this competition, WEAPON_TYPES = ["Cannon", "Chainshot"]
         self.weapon_AIs = dict()
         for weapon_type in WEAPON_TYPES:
-            #self.weapon_AIs[weapon_type] = WeaponAI(weapon_type=weapon_type, init_policy_population=POPULATION_SIZE, filename=weapon_type+".csv")
+            #self.weapon_AIs[weapon_type] = WeaponAI(weapon_type=weapon_type, init_policy_population=POPULATION_SIZE, filename=weapon_type+".npz")
             self.weapon_AIs[weapon_type] = WeaponAI(weapon_type=weapon_type, init_policy_population=POPULATION_SIZE)
+            # resume counting simulations where a loaded checkpoint stopped
+            self.simulation_count = max(self.simulation_count, self.weapon_AIs[weapon_type].generation)
         print("test")
         self.control_center = ControlCenter()
 
-        # to keep track of all actions that were executed this round
+        # to keep track of all actions that were executed this round, as (weapon type, rule row) pairs
         # to sample without replacement, we need this to be a list instead of a set
         self.actRules_executed_this_round = []
 
+        # Double buffered rule populations: the WeaponAIs play the current generation while training_update
+        # builds the next one from copies of newest_rules on the trainer thread. A finished generation waits in
+        # next_generation until swap_in_next_generation installs it between scenarios, so a scenario is always played
+        # (and its score credited) by a single generation.
+        self.trainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="training")  # one job at a time, in order
+        self.training_job = None
+        self.newest_rules = {name: weapon_AI.rules for name, weapon_AI in self.weapon_AIs.items()}  # trainer thread only
+        self.next_generation = None
+        self.generation_lock = threading.Lock()
+
+        # training_update draws from its own random number generators, the global ones are used by the scenario that
+        # is played meanwhile, so their state during an update depends on thread timing. Both are checkpointed.
+        self.training_np_random = np.random.RandomState()
+        self.training_random = random.Random()
+        for weapon_AI in self.weapon_AIs.values():
+            if weapon_AI.rules.training_rng_states is not None:
+                numpy_state, python_state = weapon_AI.rules.training_rng_states
+                self.training_np_random.set_state(numpy_state)
+                self.training_random.setstate(python_state)
+
 
     # Is passed StatePb from Planner
     def receiveStatePb(self, msg: StatePb):
@@ -99,16 +127,29 @@ class AiManager:
     def receiveScenarioInitializedNotificationPb(self, msg: ScenarioInitializedNotificationPb):
         self.actRules_executed_this_round = []  # empty the list of the weapons executed this round
         self.simulation_count += 1
+        # play this scenario on the newest generation that is done training, never swap in the middle of it
+        self.swap_in_next_generation()
         #print("Scenario run: " + str(msg.sessionId))
 
 
     # This method/message is used to nofify that a scenario/run has ended
     def receiveScenarioConcludedNotificationPb(self, msg: ScenarioConcludedNotificationPb):
         self.blacklist = set()
-        
+        executed, self.actRules_executed_this_round = self.actRules_executed_this_round, []
+        # the global generators as this scenario left them, before the next one draws from them
+        states = rng_states()
 
         #once completed, we save everything and update values in WeaponAi obj
-        self.training_update(msg.score)
+        if ASYNC_TRAINING:
+            # the previous update normally finished long before this scenario did, this only waits if it has not
+            if self.training_job is not None:
+                self.training_job.result()
+            self.swap_in_next_generation()
+            self.training_job = self.trainer.submit(self.training_update, msg.score, executed, self.simulation_count,
+                                                    states)
+        else:
+            self.training_update(msg.score, executed, self.simulation_count, states)
+            self.swap_in_next_generation()
         
         print("Ended Run: " + str(msg.sessionId) + " with score: " + str(msg.score))
 
@@ -153,27 +194,28 @@ class AiManager:
 
         @return: finalized_actions: list[ShipActionPb]
         """
-        # let the WeaponAIs know what the current situation is
+        # decode the StatePb once and let the WeaponAIs know what the current situation is
+        snapshot = StateSnapshot(msg)
         for wai in self.weapon_AIs:
-            self.weapon_AIs[wai].set_state_info(msg, self.blacklist)
+            self.weapon_AIs[wai].set_state_info(snapshot, self.blacklist)
 
         # create set of possible actions against target
         target_actions = dict()
 
         trackid_to_track = dict()
 
-        for target in msg.Tracks:
-            if target.ThreatRelationship == "Hostile" and target.TrackId not in self.blacklist:
-                trackid_to_track[target.TrackId] = target
-                current_target_actions = []
+        for target_idx in np.flatnonzero(snapshot.unengaged(self.blacklist)):
+            target = snapshot.tracks[target_idx]
+            trackid_to_track[target.TrackId] = target
+            current_target_actions = []
 
-                for defense_ship in msg.assets:
-                    for weapon in defense_ship.weapons:
-                        # get a set of proposed ( weapon, defense_ship, action_rule_that_applies ) tuples for the target
-                        proposed_actions = self.weapon_AIs[weapon.SystemName].request(weapon, defense_ship, target)
-                        current_target_actions.extend(proposed_actions)
+            for ship_idx, defense_ship in enumerate(snapshot.assets):
+                for weapon in defense_ship.weapons:
+                    # get a set of proposed ( weapon, defense_ship, action_rule_that_applies ) tuples for the target
+                    proposed_actions = self.weapon_AIs[weapon.SystemName].request(weapon, ship_idx, target_idx)
+                    current_target_actions.extend(proposed_actions)
 
-                target_actions[target.TrackId] = current_target_actions
+            target_actions[target.TrackId] = current_target_actions
 
         # initialize and apply immune system dynamics to get the top Actions
         self.control_center.decide_action_per_target(target_actions, trackid_to_track)
@@ -183,7 +225,7 @@ class AiManager:
         for target_id, target_action in target_actions.items():
             if target_action is not None:
                 # add action rules executed this round to update their fitness
-                self.actRules_executed_this_round.append(target_action[2])
+                self.actRules_executed_this_round.append((target_action[0].SystemName, target_action[2].row))
 
                 # add track to blacklist so we don't consider it anymore
                 self.blacklist.add(target_id)
@@ -199,22 +241,47 @@ class AiManager:
         return finalized_actions
 
 
-    def training_update(self, reward: int):
+    def swap_in_next_generation(self):
         """
-        RUNS AFTER SIMULATION END
+        Lets the WeaponAIs play the newest generation produced by training_update, if there is one they do not have yet.
+        Only called between scenarios. Rules only ever get appended to a population, so rule rows recorded on an
+        older generation stay valid in the newer ones.
+        @return: None
+        """
+        if self.training_job is not None and self.training_job.done():
+            job, self.training_job = self.training_job, None
+            job.result()  # raises an exception of training_update here, like a synchronous update would
+
+        with self.generation_lock:
+            next_generation, self.next_generation = self.next_generation, None
+
+        if next_generation is not None:
+            for weapon_name, rules in next_generation.items():
+                self.weapon_AIs[weapon_name].rules = rules
+
+    def training_update(self, reward: int, executed: list[tuple[str, int]], generation: int, states: tuple = None):
+        """
+        RUNS AFTER SIMULATION END, on the trainer thread if ASYNC_TRAINING
         Updates ActionRule fitness values and does training/updates on the ActionRules using either GA or HS
+        The next generation is built on copies of the newest one and handed to swap_in_next_generation when done.
         @param reward: the final score received after a scenario has concluded
+        @param executed: (weapon type, rule row) of every action rule executed in that scenario
+        @param generation: number of the scenario that concluded
+        @param states: (numpy state, python state) of the global random number generators when it concluded, saved
+        with the checkpoints (see rule_store.rng_states), their current state if None
         @return: None
         """
         #setup step size
         step = 1e-3
+
+        next_rules = {weapon_name: rules.copy() for weapon_name, rules in self.newest_rules.items()}
         
         # update fitness values
         # accuracy_sum = 0
-        for action_rule_executed in self.actRules_executed_this_round:
+        for weapon_name, row in executed:
             # accuracy_sum += action.update_predicted_values(reward)
             # I'm not sure why `step` was deleted earlier
-            action_rule_executed.update_predicted_values(reward, step)
+            next_rules[weapon_name].rule(row).update_predicted_values(reward, step)
             #print("placeholder, uncomment the above line after finishing the above TODO")
 
         # for action in best_actions:
@@ -254,13 +321,13 @@ class AiManager:
                 ^ instead of replacing with the mean, we could replace with the action rule with the highest fitness
             """
             # for _ in range(100):
-            for weapon_name in self.weapon_AIs:
+            for weapon_name in next_rules:
                 #self.control_center
-                if(self.simulation_count % 10 == 0):
+                if(generation % 10 == 0):
                     #TODO implement DBSCAN
                     pass
                 
-                weaponType_actRules = self.weapon_AIs[weapon_name].action_set
+                weaponType_actRules = next_rules[weapon_name].rules()
 
                 # Beginning the breeding process
                 # parent_actRules = set()
@@ -268,7 +335,7 @@ class AiManager:
 
                 # Calculating the prob. distribution of the fitness values to help with random
                 # sampling of the parents
-                fitness_values = np.array([rule.predicted_value for rule in weaponType_actRules])
+                fitness_values = next_rules[weapon_name].predicted_values()
                 # fitness_values = np.where(fitness_values == 0, 1 / len(fitness_values), fitness_values)
                 # fitness_values = np.where(fitness_values < 0, -fitness_values, fitness_values)
                 # fitness_based_probs = fitness_values / np.sum(fitness_values)
@@ -279,7 +346,7 @@ class AiManager:
                 # rounds to the nearest even number
                 num_parents = int(PARENT_PERCENTAGE*len(weaponType_actRules) + 0.5) & ~1
 
-                sample_action_rules = np.random.choice(weaponType_actRules, 
+                sample_action_rules = self.training_np_random.choice(weaponType_actRules, 
                                                         size = num_parents, 
                                                         replace = False,
                                                         p = fitness_based_probs)
@@ -301,7 +368,7 @@ class AiManager:
                 for i in range(len(sample_action_rules) - 1):
                     children_actRules.append(self.breed(sample_action_rules[i], sample_action_rules[i + 1]))
                     
-                self.weapon_AIs[weapon_name].update_action_set(children_actRules)
+                next_rules[weapon_name].append_rules(children_actRules)
 
                 # proposed_actions_dict = {}
                 # proposed_actions_dict[count] = set(self.weapon_AIs[weapon_name].request(WeaponPb, AssetPb, TrackPb))
@@ -317,10 +384,15 @@ class AiManager:
         
         # probably save after doing updates
         for wname in WEAPON_TYPES:
-            for action in self.weapon_AIs[wname].action_set:
-                if action.predicted_value != 0:
-                    print(action.predicted_value)
-            self.weapon_AIs[wname].save_rules("{}".format(wname))
+            predicted_values = next_rules[wname].predicted_values()
+            print("{} generation {}: {} rules, {} with a predicted value, best {}".format(
+                wname, generation, len(next_rules[wname]), np.count_nonzero(predicted_values), predicted_values.max()))
+            next_rules[wname].save_checkpoint("{}.npz".format(wname), generation, states,
+                                              (self.training_np_random.get_state(), self.training_random.getstate()))
+
+        self.newest_rules = next_rules
+        with self.generation_lock:
+            self.next_generation = next_rules
 
     # Helper methods for determining whether any weapons are left
     def weapons_are_available(self, assets: list[AssetPb]) -> bool:
@@ -402,13 +474,13 @@ class AiManager:
             
         """Mutation"""
         for i in range(NUM_FEATURES):
-            random_sample_prob = random.random()
+            random_sample_prob = self.training_random.random()
             if random_sample_prob < MUTATION_RATE_VALUES:
                 #This is dumb, should be range not current value
-                new_conditional_vals[i] += (random.random() - 0.5) * new_conditional_vals[i]
+                new_conditional_vals[i] += (self.training_random.random() - 0.5) * new_conditional_vals[i]
             if random_sample_prob < MUTATION_RATE_BITS:
                 new_bit_mask = 0
-                new_bit_mask << random.randint(0,18)
+                new_bit_mask << self.training_random.randint(0,18)
                 new_bit_mask = new_bit_mask + 1
         
         return ActionRule(conditional_vals = new_conditional_vals, cond_bits= new_bitset, fitness=0.5 * (action_rule_1.predicted_value + action_rule_2.predicted_value))
@@ -7,46 +7,58 @@ This class is analogous to the B-cell from the immunized classifier paper.
 """
 from ActionRuleClass import ActionRule, CONDITIONAL_NAMES, CONDITIONAL_ATTRIBUTE_COUNT
 from PlannerProto_pb2 import AssetPb, TrackPb, WeaponPb, StatePb
+from state_snapshot import StateSnapshot, WEAPON_TYPES
+from rule_store import RuleStore, StoredRule
 import utils
-import pandas as pd
 import numpy as np
 
 
 class WeaponAI:
     def __init__(self, weapon_type: str, filename: str = None, init_policy_population: int = None):
         """
-        The constructor for this class initializes action_set, defaulting to randomly generating the ActionRule objects
+        The constructor for this class initializes the rule population, defaulting to randomly generating the rules
         contained within, but if a file is specified, it will fetch the information from a file and initialize them
         that way.
 
         @param weapon_type: The weapon type that this WeaponAI object is for (e.g. Chainshot or Cannonball)
-        @param filename: Optional parameter for training with GA — the file where trained ActionRule are stored.
+        @param filename: Optional parameter for training with GA — the file where trained ActionRule are stored,
+        an NPZ checkpoint written by save_rules or a CSV written by save_rules_csv.
         @param init_policy_population: if no filename, then the starting number of action rules
         """
         # TODO implement pandas csv create and parse
 
         self.type = weapon_type
-        self.action_set = None  # set[ActionRule]
-        self.action_df = None  # Pandas dataframe representing action set
+        self.weapon_column = WEAPON_TYPES.index(weapon_type)  # column of this weapon type in StateSnapshot.ammo
+        self.rules = RuleStore()  # the rule population, one row per rule
+        self.generation = 0  # generation of the population, as saved in the checkpoint it was loaded from
 
-        self.current_statePb = None
+        self.snapshot = None
         self.blacklist = None
+        self.features = None  # (ships, targets, CONDITIONAL_ATTRIBUTE_COUNT) situations, see build_features
 
-        if filename:
-            self.action_df = pd.read_csv(filename)
-            self.action_set = np.array([ActionRule(bounds[:-2], bounds[-2], bounds[-1]) for bounds in self.action_df.to_numpy()])
+        if filename and filename.endswith('.csv'):
+            import pandas as pd  # only needed for CSV files
+            action_df = pd.read_csv(filename)
+            self.rules.append(action_df[CONDITIONAL_NAMES].to_numpy(), action_df['cond_bits'].to_numpy(),
+                              action_df['p_val'].to_numpy())
+
+        elif filename:
+            self.generation = self.rules.load_checkpoint(filename)
 
         else:
             if init_policy_population is None:
                 raise RuntimeError("Must specify `init_policy_population` parameter for WeaponAI constructor")
 
-            self.action_set = np.array([ActionRule() for _ in range(init_policy_population)])
-            self.action_df = pd.DataFrame(
-                data=[np.append(a.conditional_vals, [a.conditional_bits, a.predicted_value]) for a in self.action_set],
-                columns=CONDITIONAL_NAMES + ['cond_bits', 'p_val']
-            )
+            self.rules.append_random(init_policy_population)
 
-    def request(self, weapon: WeaponPb, ship: AssetPb, target: TrackPb) -> list[tuple[WeaponPb, AssetPb, ActionRule]]:
+    @property
+    def action_set(self) -> np.ndarray:
+        """
+        @return: object array of every rule in the population, as StoredRules
+        """
+        return self.rules.rules()
+
+    def request(self, weapon: WeaponPb, ship: int, target: int) -> list[tuple[WeaponPb, AssetPb, StoredRule]]:
         """
         Generates a strategy for a specific weapon, ship and target.
 
@@ -57,8 +69,8 @@ class WeaponAI:
         following format: ( weapon_system, ship, target, ActionRule ).
 
         @param weapon: The weapon requesting analysis
-        @param ship: The ship that the weapon is on.
-        @param target: The target (missile) that the weapon is currently considering.
+        @param ship: Index of the ship that the weapon is on, in the current StateSnapshot.
+        @param target: Index of the target (missile) that the weapon is currently considering, in the current StateSnapshot.
 
         @return: proposed_actions - a list of potential weapon assingment to this target
         (hostile TrackId and in ShipActionPb)
@@ -66,13 +78,12 @@ class WeaponAI:
         # if target not in self.trackID_to_track:
         #     self.trackID_to_track[target.TrackID] = target
 
-        proposed_actions = []
-
-        for action_rule in self.action_set:
-            if self.evaluate(weapon, ship, target, action_rule):
-                proposed_actions.append((weapon, ship, action_rule))
+        # the situation is the same for every rule, so it is only calculated once
+        calculated_conditional_list = self.calc_conditionals(ship, target)
+        ship_pb = self.snapshot.assets[ship]
 
-        return proposed_actions
+        matches = np.flatnonzero(self.evaluate_all(calculated_conditional_list))
+        return [(weapon, ship_pb, self.rules.rule(row)) for row in matches]
     
 
     def update_action_set(self, new_actions: list[ActionRule]):
@@ -84,91 +95,85 @@ class WeaponAI:
         """
         assert type(new_actions) == list
 
-        np.append(self.action_set, new_actions)
-        self.action_df = pd.DataFrame(columns=CONDITIONAL_NAMES + ['cond_bits', 'p_val'])
-        for a in self.action_set:
-            self.action_df.loc[len(self.action_df.index)] = np.append(a.conditional_vals, [a.conditional_bits, a.predicted_value])
-        # new_data = pd.DataFrame(
-        #     data=[np.append(n.conditional_vals, [n.conditional_bits, n.predicted_value]) for n in new_actions],
-        #     columns=CONDITIONAL_NAMES + ['cond_bits', 'p_val']
-        # )
-        # self.action_df = pd.concat([self.action_df, new_data], ignore_index=True)
-        print(self.action_df)
+        self.rules.append_rules(new_actions)
+        print("{} population: {} rules".format(self.type, len(self.rules)))
 
 
-    def evaluate(self, weapon: WeaponPb, ship: AssetPb, target: TrackPb, action_rule: ActionRule) -> bool:
+    def calc_conditionals(self, ship: int, target: int) -> list[float]:
         """
-        Given an input situation and an ActionRule, evaluates the ActionRule to see if it fits the scenario.
+        Returns the situation an ActionRule is evaluated against, in the order of CONDITIONAL_NAMES.
 
-        @param weapon: The weapon requesting analysis
-        @param ship: The ship that the weapon is on.
-        @param target: The target (missile) that the weapon is currently considering.
-        @param action_rule: The ActionRule we are considering for this situation
-
-        @return: The evaluated boolean truth value of the ActionRule, given the scenario
-        """
-        calculated_conditional_list = [self.calc_distance_to_target(ship, target),
-                                       self.calc_target_speed(target),
-                                       self.calc_target_deviation(ship, target),
-                                       self.calc_target_height(target),
-                                       self.calc_threat_danger(target),
-                                       self.ammo_on_ship(weapon),
-                                       self.calc_nearby_ship_health(ship),
-                                       self.calc_my_ship_health(ship),
-                                       self.calc_number_of_targets()]
-
-        conditional_bits = action_rule.get_cond_bitstr()
-        conditional_cutoffs = action_rule.get_conditional_values()
-
-        return_val = None
-
-        #grab AND/OR, LE/GE bits for each element in our calculated conditional list
-        #starting at the rightmost side of the integer
-        #EVEN indexed bits are AND/OR -> 0/1
-        #ODD indexed bits are LE/GE -> 0/1
-        #KYLE : maybe we might want a separate grabber method for individual bit pairs?
-        for idx in range(CONDITIONAL_ATTRIBUTE_COUNT):
-            # and_or_or = conditional_bits & 1
-            and_or_or = conditional_bits % 2
-            conditional_bits = conditional_bits // 2
-            le_or_ge = conditional_bits % 2
-            conditional_bits = conditional_bits // 2
-
-            current_truth = False
-
-            if le_or_ge:
-                current_truth = (calculated_conditional_list[idx] > conditional_cutoffs[idx])
-            else:
-                current_truth = (calculated_conditional_list[idx] <= conditional_cutoffs[idx])
-
-            # initialization; we ignore the first and_or_or
-            if return_val is None:
-                return_val = current_truth
-
-            else: 
-                if and_or_or:
-                    return_val = return_val or current_truth
-                else:
-                    return_val = return_val and current_truth
+        @param ship: Index of the ship that the weapon is on.
+        @param target: Index of the target (missile) that the weapon is currently considering.
 
-        return return_val
+        @return: The values of the conditional attributes for this ship and target
+        """
+        return self.features[ship, target]
 
+    def build_features(self) -> np.ndarray:
+        """
+        Calculates the conditional attributes of every ship and target in the current state at once.
 
-    def save_rules(self, filename):
+        @return: (ships, targets, CONDITIONAL_ATTRIBUTE_COUNT) array, in the order of CONDITIONAL_NAMES
+        """
+        ships, targets = self.snapshot.asset_count(), self.snapshot.track_count()
+        per_ship = np.ones((ships, 1))
+        per_target = np.ones((1, targets))
+
+        return np.stack([self.calc_distance_to_target(),
+                         self.calc_target_speed()[None, :] * per_ship,
+                         self.calc_target_deviation(),
+                         self.calc_target_height()[None, :] * per_ship,
+                         self.calc_threat_danger()[None, :] * per_ship,
+                         self.ammo_on_ship()[:, None] * per_target,
+                         self.calc_nearby_ship_health()[:, None] * per_target,
+                         self.calc_my_ship_health()[:, None] * per_target,
+                         np.full((ships, targets), self.calc_number_of_targets())], axis=2)
+
+    def evaluate_all(self, calculated_conditional_list: list[float]) -> np.ndarray:
+        """
+        Evaluates every rule in the population against an input situation at once.
+
+        @param calculated_conditional_list: The situation, as returned by calc_conditionals
+
+        @return: Boolean mask over the rows of self.rules of the rules that fit the scenario
+        """
+        situation = np.asarray(calculated_conditional_list, dtype=float)
+        cutoffs = self.rules.cutoffs()
+        truths = np.where(self.rules.greater(), situation > cutoffs, situation <= cutoffs)
+        joined_by_or = self.rules.joined_by_or()
+
+        # the conditionals are combined from left to right, the first AND/OR bit is ignored
+        return_val = truths[:, 0]
+        for idx in range(1, CONDITIONAL_ATTRIBUTE_COUNT):
+            return_val = np.where(joined_by_or[:, idx], return_val | truths[:, idx], return_val & truths[:, idx])
+
+        return return_val
+
+    def save_rules(self, filename, generation: int = 0):
         # Joseph: Hmmm I have questions about this method being here
         # because we should be updating the set of rules during the genetic update;
         # this class only exists to select the best actions and does not perform mutation/crossover
         # to produce a new set of rules.
         """
-        This function saves all ActionRules to a file named filename, overwriting that file if it already exists, and
-        creating it if it does not.
+        This function saves all ActionRules to an NPZ checkpoint named filename.npz, overwriting that file if it
+        already exists, and creating it if it does not. See RuleStore.save_checkpoint.
 
         @param filename: The filename, as a string, where this function will save the ActionRules to.
+        @param generation: The generation of the population, saved with it
         @return: None
         """
+        self.rules.save_checkpoint('{}.npz'.format(filename), generation)
 
-        # TODO Figure out the formatting for the file output
-        self.action_df.to_csv('{}.csv'.format(filename), index=False)#sep='\n')
+    def save_rules_csv(self, filename):
+        """
+        This function saves all ActionRules to a CSV file named filename.csv, for inspecting them, overwriting that
+        file if it already exists, and creating it if it does not.
+
+        @param filename: The filename, as a string, where this function will save the ActionRules to.
+        @return: None
+        """
+        self.rules.to_dataframe().to_csv('{}.csv'.format(filename), index=False)
 
     '''def save_rules_txt(self, filename):
         # just in case pandas is not allowed
@@ -183,17 +188,19 @@ class WeaponAI:
         # TODO Figure out the formatting for the file output
         with open(filename, "w") as rf:'''
             
-    def set_state_info(self, state_pb: StatePb, blacklist: set) -> None:
+    def set_state_info(self, snapshot: StateSnapshot, blacklist: set) -> None:
         """
-        Use this function to give this WeaponAI access to the current StatePb and blacklist.
+        Use this function to give this WeaponAI access to the current state and blacklist. The conditional
+        attributes of every ship and target are calculated here, once per timestep.
 
-        @param state_pb: The StatePb at the current timestep
+        @param snapshot: The StatePb at the current timestep, decoded into arrays
         @param blacklist: The blacklist at the current timestep
 
         @return: None
         """
-        self.current_statePb = state_pb
+        self.snapshot = snapshot
         self.blacklist = blacklist
+        self.features = self.build_features()
     
     # def calc_distance(self, a, b):
     #     """
@@ -210,30 +217,23 @@ class WeaponAI:
     #     return np.linalg.norm(b_pos - a_pos)
 
 
-    def calc_distance_to_target(self, ship: AssetPb, target: TrackPb) -> float:
+    def calc_distance_to_target(self) -> np.ndarray:
         """
-        Calculates the squared distance from a ship to a target
-        @param ship: The ship
-        @param target: The target
-        @return: the distance from a ship to a target
+        Calculates the squared distance from every ship to every target
+        @return: (ships, targets) squared distances
         """
-        # return self.calc_distance(ship, target)
-        ship_pos = (ship.PositionX, ship.PositionY, ship.PositionZ)
-        target_pos = (target.PositionX, target.PositionY, target.PositionZ)
-        
-        # return np.linalg.norm(target_pos - ship_pos)
-        return utils.distance(*ship_pos, *target_pos)
+        pos_diff = self.snapshot.track_positions[None, :, :] - self.snapshot.asset_positions[:, None, :]
+        return np.einsum('ijk,ijk->ij', pos_diff, pos_diff)
 
-    def calc_target_speed(self, target: TrackPb) -> float:
+    def calc_target_speed(self) -> np.ndarray:
         """
-        Returns the target's squared speed
-        @param target: The target
-        @return: Squared speed of the target
+        Returns the targets' squared speeds
+        @return: (targets,) squared speed of every target
         """
-        # return np.linalg.norm([target.VelocityX, target.VelocityY, target.VelocityZ])
-        return utils.magnitude_sq(target.VelocityX, target.VelocityY, target.VelocityZ)
+        target_velocity = self.snapshot.track_velocities
+        return np.einsum('ij,ij->i', target_velocity, target_velocity)
 
-    def calc_target_deviation(self, ship: AssetPb, target: TrackPb) -> float:
+    def calc_target_deviation(self) -> np.ndarray:
         """
         The idea is to have some measurement that quantifies how closely a target
         is approaching a ship. The insight is that we can use the supplementary angle
@@ -243,90 +243,81 @@ class WeaponAI:
         deviation indicates that the target is probably approaching another target, while a smaller
         indicates that the target is approaching towards the ship.
 
-        @param ship: The ship
-        @param target: The target
-
-        @return: The supplementary angle between the target's heading and the ship's heading, in radians.
+        @return: (ships, targets) supplementary angle between the target's heading and the ship's heading, in radians.
         - Why supplementary? Because we want it so that this returns 0 when the ship and missile are
         currently directing facing each other. This would be 180 degrees (or 2pi radians) with just the angle itself.
         Relative to the ship in this case, the target has 0 degree deviance away from the ship.
         """
-        ship_pos = (ship.PositionX, ship.PositionY, ship.PositionZ)
-        target_pos = (target.PositionX, target.PositionY, target.PositionZ)
-        pos_diff = tuple(target_pos[i] - ship_pos[i] for i in range(3))
+        pos_diff = self.snapshot.track_positions[None, :, :] - self.snapshot.asset_positions[:, None, :]
+        target_velocity = self.snapshot.track_velocities
 
-        target_velocity = (target.VelocityX, target.VelocityY, target.VelocityZ)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.pi - np.arccos(
+                np.round(
+                np.einsum('ijk,jk->ij', pos_diff, target_velocity) /
+                (self.calc_distance_to_target() * self.calc_target_speed()[None, :]) ** 0.5,
+                         2)
+                )
 
+    def all_ships(self) -> tuple:
+        """
+        The ships the summed attributes go over: every asset of the StatePb, the reference ship included,
+        as it always was for calc_threat_danger and calc_nearby_ship_health (the trained rules expect it).
 
-        return np.pi - np.arccos(
-            np.round(
-            utils.dot(*pos_diff, *target_velocity) / 
-            (utils.magnitude_sq(*pos_diff) * utils.magnitude_sq(*target_velocity)) ** 0.5, 
-                     2)
-            )
+        @return: (positions, health, HVU) arrays of the snapshot's assets, followed by the reference ship if any
+        """
+        reference = self.snapshot.reference_asset
+        if reference is None:
+            return self.snapshot.asset_positions, self.snapshot.asset_health, self.snapshot.asset_HVU
+        return (np.vstack([self.snapshot.asset_positions,
+                           [(reference.PositionX, reference.PositionY, reference.PositionZ)]]),
+                np.append(self.snapshot.asset_health, reference.health),
+                np.append(self.snapshot.asset_HVU, reference.isHVU))
 
-    def calc_threat_danger(self, target: TrackPb) -> float:
+    def calc_threat_danger(self) -> np.ndarray:
         """
-        Given the target, and the current state, computes the overall danger of a threat
+        Given the current state, computes the overall danger of every threat
         based on summed nearness to all of the ships, weighted by the values of the ships.
         The more near, the more dangerous,
 
         Threat danger = {sum over all ships} (max distance - distance to ship) (4 if HVU 1 if NU)
 
-        @param ship: The ship
-        @param target: The target
-        @return: The ship compassion for this current weapon
+        @return: (targets,) threat danger of every target
         """
-        # target_pos = (target.PositionX, target.PositionY, target.PositionZ)
-        # asset_pos = (asset.PositionX, asset.PositionY, asset.PositionZ)
-
-        threat_danger = 0
-        for asset in self.current_statePb.assets:
-            threat_danger += utils.DISTANCE_SCALE * \
-                    (utils.MAX_DISTANCE - self.calc_distance_to_target(asset, target)) * \
-                    (4 if asset.isHVU else 1)
+        positions, _, HVU = self.all_ships()
+        pos_diff = self.snapshot.track_positions[None, :, :] - positions[:, None, :]
+        distances = np.einsum('ijk,ijk->ij', pos_diff, pos_diff)
 
-        return threat_danger
+        return np.sum(utils.DISTANCE_SCALE * (utils.MAX_DISTANCE - distances) * np.where(HVU, 4, 1)[:, None], axis=0)
 
-    def calc_target_height(self, target: TrackPb) -> float:
+    def calc_target_height(self) -> np.ndarray:
         """
-        Given the target, returns its height above the water.
+        Returns the height of every target above the water.
 
-        @param target: The target
-        @return: The height of the target above the water.
+        @return: (targets,) height of the targets above the water.
         """
-        return target.PositionZ
+        return self.snapshot.track_positions[:, 2]
 
-    def calc_nearby_ship_health(self, ship: AssetPb) -> float:
+    def calc_nearby_ship_health(self) -> np.ndarray:
         """
         Calculates a sum of the health values of nearby ships to the weapon, weighted by distance.
         The nearer the other ships are, the more this quantity goes up.
 
-        @param ship: The ship
-
-        @return: sum of the health values of nearby ships, weighted by distance.
+        @return: (ships,) sum of the health values of nearby ships, weighted by distance, for every ship.
         """
-        ship_pos = (ship.PositionX, ship.PositionY, ship.PositionZ)
-
-        w_ship_health = 0
+        positions, health, _ = self.all_ships()
+        pos_diff = positions[None, :, :] - self.snapshot.asset_positions[:, None, :]
+        distances = np.einsum('ijk,ijk->ij', pos_diff, pos_diff)
 
-        for asset in self.current_statePb.assets:
-            asset_pos = (asset.PositionX, asset.PositionY, asset.PositionZ)
-            w_ship_health += utils.DISTANCE_SCALE * \
-                    (utils.MAX_DISTANCE - utils.distance(*ship_pos, *asset_pos)) * \
-                        (asset.health)
+        return np.sum(utils.DISTANCE_SCALE * (utils.MAX_DISTANCE - distances) * health, axis=1)
 
-        return w_ship_health
-
-    def calc_my_ship_health(self, ship: AssetPb) -> int:
+    def calc_my_ship_health(self) -> np.ndarray:
         """
-        Returns this ship's health
-
-        @param ship: The ship
+        Returns the health of every ship
 
-        @return: returns this ship's health
+        @return: (ships,) health of every ship
         """
-        return ship.health
+        return self.snapshot.asset_health
 
     def calc_number_of_targets(self) -> int:
         """
@@ -334,18 +325,12 @@ class WeaponAI:
 
         @return: the number of unassigned enemy missiles in StatePb
         """
-        count = 0
-        for track in self.current_statePb.Tracks:
-            if track.ThreatRelationship == "Hostile" and track.TrackId not in self.blacklist:
-                count += 1
-        return count
+        return int(np.count_nonzero(self.snapshot.unengaged(self.blacklist)))
 
-    def ammo_on_ship(self, weapon: WeaponPb) -> int:
+    def ammo_on_ship(self) -> np.ndarray:
         """
-        Returns the quantity of ammunition remaining for this weapon type on the ship
+        Returns the quantity of ammunition remaining for this weapon type on every ship
 
-        @param weapon:
-        @param ship:
-        @return: the amount of ammunition remaining for this weapon type on this ship
+        @return: (ships,) the amount of ammunition remaining for this weapon type on every ship
         """
-        return weapon.Quantity
\ No newline at end of file
+        return self.snapshot.ammo[:, self.weapon_column]
@@ -0,0 +1,337 @@
+"""
+The RuleStore class holds a population of ActionRules column by column: one NumPy array each for the conditional
+values (cutoffs), the conditional bits, the predicted values and the fitness values, with row i of every array
+belonging to rule i. A WeaponAI evaluates, trains and saves its whole population through these arrays instead of
+through one ActionRule object per rule.
+
+Code that works on single rules (e.g. the ControlCenter and breeding) gets StoredRule objects, which behave like
+ActionRules but read and write their row of the store.
+
+Populations are saved as NPZ checkpoints (save_checkpoint/load_checkpoint), which also hold the generation number and
+the state of the random number generators, so training can be resumed where it stopped: the global numpy and python
+ones the scenarios are played with, and optionally the ones the training updates draw from (see AiManager).
+"""
+from ActionRuleClass import ActionRule, BOUNDS, CONDITIONAL_NAMES, CONDITIONAL_ATTRIBUTE_COUNT
+import numpy as np
+import random
+
+"""@cvar MIN_CAPACITY - number of rows the columns start with, they double whenever they run out of room"""
+MIN_CAPACITY = 64
+
+
+def rng_states() -> tuple:
+    """
+    @return: (numpy state, python state) of the global numpy and python random number generators, as returned by
+    np.random.get_state() and random.getstate()
+    """
+    return np.random.get_state(), random.getstate()
+
+
+def rng_state_arrays(prefix: str, states: tuple) -> dict:
+    """
+    @param prefix: prefix of the checkpoint entries, to keep several generator pairs apart
+    @param states: (numpy state, python state) in the formats of np.random.get_state() and random.getstate()
+    @return: the states as checkpoint entries for np.savez
+    """
+    (_, keys, position, has_gauss, cached_gaussian), (python_version, python_state, python_gauss) = states
+    return {prefix + 'numpy_rng_keys': keys, prefix + 'numpy_rng_position': position,
+            prefix + 'numpy_rng_has_gauss': has_gauss, prefix + 'numpy_rng_cached_gaussian': cached_gaussian,
+            prefix + 'python_rng_version': python_version,
+            prefix + 'python_rng_state': np.array(python_state, dtype=np.uint64),
+            prefix + 'python_rng_gauss': np.nan if python_gauss is None else python_gauss}
+
+
+def read_rng_states(checkpoint, prefix: str) -> tuple:
+    """
+    @param checkpoint: an opened NPZ checkpoint
+    @param prefix: prefix the states were saved with, see rng_state_arrays
+    @return: (numpy state, python state), None if the checkpoint has no states with that prefix
+    """
+    if prefix + 'numpy_rng_keys' not in checkpoint:
+        return None
+    numpy_state = ('MT19937', checkpoint[prefix + 'numpy_rng_keys'], int(checkpoint[prefix + 'numpy_rng_position']),
+                   int(checkpoint[prefix + 'numpy_rng_has_gauss']),
+                   float(checkpoint[prefix + 'numpy_rng_cached_gaussian']))
+    python_gauss = float(checkpoint[prefix + 'python_rng_gauss'])
+    python_state = (int(checkpoint[prefix + 'python_rng_version']),
+                    tuple(int(word) for word in checkpoint[prefix + 'python_rng_state']),
+                    None if np.isnan(python_gauss) else python_gauss)
+    return numpy_state, python_state
+
+
+class RuleStore:
+    def __init__(self):
+        """
+        Constructor for an empty RuleStore.
+        """
+        self.count = 0
+        self.training_rng_states = None  # (numpy state, python state) of the training updates, if loaded with them
+
+        # the columns, with room for more rules than count; only the first count rows are rules
+        self.cutoff_column = np.zeros((MIN_CAPACITY, CONDITIONAL_ATTRIBUTE_COUNT))
+        self.bits_column = np.zeros(MIN_CAPACITY, dtype=np.int64)
+        self.predicted_value_column = np.zeros(MIN_CAPACITY)
+        self.fitness_column = np.zeros(MIN_CAPACITY)
+
+        # conditional_bits decoded per conditional, kept up to date with bits_column
+        self.greater_column = np.zeros((MIN_CAPACITY, CONDITIONAL_ATTRIBUTE_COUNT), dtype=bool)  # LE/GE bit is GE
+        self.joined_by_or_column = np.zeros((MIN_CAPACITY, CONDITIONAL_ATTRIBUTE_COUNT), dtype=bool)  # AND/OR bit is OR
+
+    def __len__(self):
+        return self.count
+
+    # (rules, CONDITIONAL_ATTRIBUTE_COUNT) conditional values
+    def cutoffs(self) -> np.ndarray:
+        return self.cutoff_column[:self.count]
+
+    # (rules,) conditional_bits, encoded as described in ActionRuleClass
+    def bits(self) -> np.ndarray:
+        return self.bits_column[:self.count]
+
+    # (rules,) predicted values, which the ControlCenter and the genetic algorithm use as fitness
+    def predicted_values(self) -> np.ndarray:
+        return self.predicted_value_column[:self.count]
+
+    # (rules,) ActionRule.fitness values
+    def fitness(self) -> np.ndarray:
+        return self.fitness_column[:self.count]
+
+    # (rules, CONDITIONAL_ATTRIBUTE_COUNT) True where the conditional is GE (>) instead of LE (<=)
+    def greater(self) -> np.ndarray:
+        return self.greater_column[:self.count]
+
+    # (rules, CONDITIONAL_ATTRIBUTE_COUNT) True where the conditional is ORed in instead of ANDed
+    def joined_by_or(self) -> np.ndarray:
+        return self.joined_by_or_column[:self.count]
+
+    def append(self, cutoffs: np.ndarray, bits: np.ndarray, predicted_values: np.ndarray, fitness: np.ndarray = None):
+        """
+        Adds rules at the end of the store.
+
+        @param cutoffs: (new rules, CONDITIONAL_ATTRIBUTE_COUNT) conditional values
+        @param bits: (new rules,) conditional_bits
+        @param predicted_values: (new rules,) predicted values
+        @param fitness: (new rules,) fitness values, 0 by default
+
+        @return: the rows of the new rules
+        """
+        bits = np.asarray(bits).reshape(-1)
+        rows = np.arange(self.count, self.count + len(bits))
+        self.reserve(self.count + len(bits))
+        self.count += len(bits)
+        self.replace(rows, cutoffs, bits, predicted_values, np.zeros(len(bits)) if fitness is None else fitness)
+        return rows
+
+    def append_random(self, count: int):
+        """
+        Adds randomly initialized rules, drawn the same way as ActionRule() draws one.
+
+        @param count: the number of rules to add
+        @return: the rows of the new rules
+        """
+        cutoffs = np.random.randint(low=BOUNDS[:, 0], high=BOUNDS[:, 1] + 1, size=(count, CONDITIONAL_ATTRIBUTE_COUNT))
+        bits = np.random.randint(0, 2 ** (2 * CONDITIONAL_ATTRIBUTE_COUNT), size=count)
+        return self.append(cutoffs, bits, np.zeros(count))
+
+    def append_rules(self, action_rules: list[ActionRule]):
+        """
+        Adds ActionRule objects, e.g. the children of the genetic algorithm.
+
+        @param action_rules: the rules to add
+        @return: the rows of the new rules
+        """
+        return self.append(np.array([rule.get_conditional_values() for rule in action_rules], dtype=float).reshape(-1, CONDITIONAL_ATTRIBUTE_COUNT),
+                           np.array([int(rule.get_cond_bitstr()) for rule in action_rules], dtype=np.int64),
+                           np.array([rule.predicted_value for rule in action_rules], dtype=float),
+                           np.array([rule.fitness for rule in action_rules], dtype=float))
+
+    def replace(self, rows: np.ndarray, cutoffs: np.ndarray, bits: np.ndarray, predicted_values: np.ndarray,
+                fitness: np.ndarray = None):
+        """
+        Overwrites existing rules in place.
+
+        @param rows: the rows to overwrite
+        @param cutoffs: (rows, CONDITIONAL_ATTRIBUTE_COUNT) new conditional values
+        @param bits: (rows,) new conditional_bits
+        @param predicted_values: (rows,) new predicted values
+        @param fitness: (rows,) new fitness values, unchanged by default
+
+        @return: None
+        """
+        bits = np.asarray(bits, dtype=np.int64).reshape(-1)
+        self.cutoff_column[rows] = np.asarray(cutoffs, dtype=float).reshape(-1, CONDITIONAL_ATTRIBUTE_COUNT)
+        self.bits_column[rows] = bits
+        self.predicted_value_column[rows] = predicted_values
+        if fitness is not None:
+            self.fitness_column[rows] = fitness
+
+        shifts = 2 * np.arange(CONDITIONAL_ATTRIBUTE_COUNT)
+        self.joined_by_or_column[rows] = (bits[:, None] >> shifts) & 1 == 1
+        self.greater_column[rows] = (bits[:, None] >> (shifts + 1)) & 1 == 1
+
+    def copy(self) -> "RuleStore":
+        """
+        @return: an independent RuleStore with the same rules, e.g. to build the next generation on
+        while this one is still in use
+        """
+        store = RuleStore()
+        store.reserve(self.count)
+        for name in ("cutoff_column", "bits_column", "predicted_value_column", "fitness_column",
+                     "greater_column", "joined_by_or_column"):
+            getattr(store, name)[:self.count] = getattr(self, name)[:self.count]
+        store.count = self.count
+        return store
+
+    def reserve(self, capacity: int):
+        """
+        Makes sure the columns have room for at least capacity rules, doubling their size as needed.
+
+        @param capacity: the number of rules the columns need to hold
+        @return: None
+        """
+        old_capacity = len(self.bits_column)
+        if capacity <= old_capacity:
+            return
+
+        new_capacity = max(capacity, 2 * old_capacity)
+        for name in ("cutoff_column", "bits_column", "predicted_value_column", "fitness_column",
+                     "greater_column", "joined_by_or_column"):
+            column = getattr(self, name)
+            grown = np.zeros((new_capacity,) + column.shape[1:], dtype=column.dtype)
+            grown[:old_capacity] = column
+            setattr(self, name, grown)
+
+    def rule(self, row: int) -> "StoredRule":
+        """
+        @param row: the row of a rule
+        @return: a StoredRule for that row
+        """
+        return StoredRule(self, row)
+
+    def rules(self, rows: np.ndarray = None) -> np.ndarray:
+        """
+        @param rows: the rows of the rules, every rule by default
+        @return: object array of StoredRules for those rows
+        """
+        if rows is None:
+            rows = range(self.count)
+        stored_rules = np.empty(len(rows), dtype=object)
+        stored_rules[:] = [StoredRule(self, row) for row in rows]
+        return stored_rules
+
+    def save_checkpoint(self, filename: str, generation: int = 0, states: tuple = None,
+                        training_states: tuple = None):
+        """
+        Saves the rules, the generation number and the state of the numpy and python random number generators
+        to an uncompressed NPZ file, overwriting it if it already exists.
+
+        @param filename: The file to save to, numpy adds .npz if it does not end with it
+        @param generation: The generation (number of simulations trained) of this population
+        @param states: (numpy state, python state) of the global generators to save, see rng_states. Defaults to
+        their current state, pass the state taken when the scenario concluded when saving from another thread.
+        @param training_states: (numpy state, python state) of the generators the training updates draw from, if any
+        @return: None
+        """
+        entries = rng_state_arrays('', states if states is not None else rng_states())
+        if training_states is not None:
+            entries.update(rng_state_arrays('training_', training_states))
+
+        np.savez(filename,
+                 cutoffs=self.cutoffs(), bits=self.bits(), greater=self.greater(), joined_by_or=self.joined_by_or(),
+                 predicted_values=self.predicted_values(), fitness=self.fitness(), generation=generation, **entries)
+
+    def load_checkpoint(self, filename: str, restore_rng: bool = True) -> int:
+        """
+        Replaces the rules in this store with the ones of a checkpoint written by save_checkpoint.
+
+        @param filename: The NPZ file to load
+        @param restore_rng: Whether to also put the global random number generators back in their saved state.
+        The states of the training generators, if saved, are kept in training_rng_states either way.
+        @return: The generation number saved with the rules
+        """
+        with np.load(filename) as checkpoint:
+            self.count = 0
+            self.reserve(len(checkpoint['bits']))
+            self.count = len(checkpoint['bits'])
+            rows = np.arange(self.count)
+            self.cutoff_column[rows] = checkpoint['cutoffs']
+            self.bits_column[rows] = checkpoint['bits']
+            self.greater_column[rows] = checkpoint['greater']
+            self.joined_by_or_column[rows] = checkpoint['joined_by_or']
+            self.predicted_value_column[rows] = checkpoint['predicted_values']
+            self.fitness_column[rows] = checkpoint['fitness']
+
+            if restore_rng:
+                numpy_state, python_state = read_rng_states(checkpoint, '')
+                np.random.set_state(numpy_state)
+                random.setstate(python_state)
+            self.training_rng_states = read_rng_states(checkpoint, 'training_')
+
+            return int(checkpoint['generation'])
+
+    def to_dataframe(self):
+        """
+        Exports the rules as a DataFrame with the columns CONDITIONAL_NAMES + ['cond_bits', 'p_val'], one row per rule,
+        e.g. to inspect them as a CSV. The DataFrame is not kept up to date with the store.
+
+        @return: pandas DataFrame
+        """
+        import pandas as pd  # only needed for exports, not for training or playing
+
+        data = np.column_stack([self.cutoffs(), self.bits(), self.predicted_values()])
+        return pd.DataFrame(data=data, columns=CONDITIONAL_NAMES + ['cond_bits', 'p_val'])
+
+
+class StoredRule:
+    """
+    One rule of a RuleStore, with the ActionRule methods the ControlCenter and the genetic algorithm use.
+    Reads and writes go straight to the store's columns.
+    """
+
+    def __init__(self, store: RuleStore, row: int):
+        """
+        @param store: the RuleStore the rule is in
+        @param row: the row of the rule in that store
+        """
+        self.store = store
+        self.row = row
+
+    @property
+    def predicted_value(self) -> float:
+        return self.store.predicted_value_column[self.row]
+
+    @predicted_value.setter
+    def predicted_value(self, value: float):
+        self.store.predicted_value_column[self.row] = value
+
+    @property
+    def fitness(self) -> float:
+        return self.store.fitness_column[self.row]
+
+    def update_predicted_values(self, reward: int, step: float):
+        """
+        Same as ActionRule.update_predicted_values.
+
+        @param reward: The reward quantity from an action
+        @param step: The step size for an update
+        @return: None
+        """
+        self.predicted_value += step * reward
+
+    def get_fitness(self):
+        """
+        @return: The current fitness value for this rule
+        """
+        return self.predicted_value
+
+    def get_cond_bitstr(self):
+        """
+        @return: The conditional attributes bitstring
+        """
+        return int(self.store.bits_column[self.row])
+
+    def get_conditional_values(self) -> np.ndarray:
+        """
+        @return: A copy of the values encoded within the conditional.
+        """
+        return self.store.cutoff_column[self.row].copy()
@@ -0,0 +1,192 @@
+import numpy as np
+from PlannerProto_pb2 import StatePb
+
+# Column order of the per weapon arrays
+WEAPON_TYPES = ["Cannon_System", "Chainshot_System"]
+WEAPON_SPEEDS = np.array([3500.0, 1234.0])  # m/s, same order as WEAPON_TYPES
+
+REFERENCE_SHIP = "Galleon_REFERENCE_SHIP"
+
+SCENARIO_LENGTH = 300  # s, missiles that get nowhere before the scenario ends do not matter
+
+
+# Everything the strategies read from a StatePb, decoded in a single pass into contiguous arrays.
+# Build one per StatePb and hand it to every strategy instead of walking msg.assets/msg.Tracks again:
+#   snapshot = StateSnapshot(msg)
+#   snapshot.asset_positions[i], snapshot.ammo[i, WEAPON_TYPES.index("Chainshot_System")], ...
+# Assets are our ships without the reference ship, tracks are the hostile tracks only.
+# Row i of every asset_*/ammo/ready array is asset i, row j of every track_* array is track j.
+class StateSnapshot:
+
+    # Constructor
+    def __init__(self, msg: StatePb):
+        self.time = msg.time
+        self.score = msg.score
+
+        self.assets = []  # AssetPb per index, for code that still needs the messages
+        self.reference_asset = None  # AssetPb of REFERENCE_SHIP, which is left out of the asset arrays
+        self.asset_names = []
+        asset_rows = []  # (x, y, z, health, isHVU)
+        ammo_rows = []
+        ready_rows = []
+        for asset in msg.assets:
+            if asset.AssetName == REFERENCE_SHIP:
+                self.reference_asset = asset
+                continue
+            self.assets.append(asset)
+            self.asset_names.append(asset.AssetName)
+            asset_rows.append((asset.PositionX, asset.PositionY, asset.PositionZ, asset.health, asset.isHVU))
+
+            ammo = [0] * len(WEAPON_TYPES)
+            ready = [False] * len(WEAPON_TYPES)
+            for weapon in asset.weapons:
+                column = WEAPON_TYPES.index(weapon.SystemName)
+                ammo[column] = weapon.Quantity
+                ready[column] = weapon.WeaponState == "Ready"
+            ammo_rows.append(ammo)
+            ready_rows.append(ready)
+
+        self.tracks = []  # TrackPb per index
+        self.threat_ids = []
+        track_rows = []  # (TrackId, x, y, z, vx, vy, vz)
+        for track in msg.Tracks:
+            if track.ThreatRelationship == "Hostile":
+                self.tracks.append(track)
+                self.threat_ids.append(track.ThreatId)
+                track_rows.append((track.TrackId, track.PositionX, track.PositionY, track.PositionZ,
+                                   track.VelocityX, track.VelocityY, track.VelocityZ))
+
+        asset_array = np.array(asset_rows, dtype=float).reshape(-1, 5)
+        self.asset_positions = asset_array[:, 0:3]
+        self.asset_health = asset_array[:, 3].astype(int)
+        self.asset_HVU = asset_array[:, 4] != 0
+        self.ammo = np.array(ammo_rows, dtype=int).reshape(-1, len(WEAPON_TYPES))  # (assets, weapon types)
+        self.ready = np.array(ready_rows, dtype=bool).reshape(-1, len(WEAPON_TYPES))  # WeaponState == "Ready"
+
+        track_array = np.array(track_rows, dtype=float).reshape(-1, 7)
+        self.track_ids = track_array[:, 0].astype(int)
+        self.track_positions = track_array[:, 1:4]
+        self.track_velocities = track_array[:, 4:7]
+
+        self.asset_index = {name: i for i, name in enumerate(self.asset_names)}
+        self.track_index = {track_id: j for j, track_id in enumerate(self.track_ids.tolist())}
+
+        # computed on first use
+        self.impacts = None  # impact_matrices() result
+        self.ship_distance = None
+        self.targets = None  # target_assignment() result
+        self.windows = None  # intercept_windows() result
+        self.track_cache = None  # set by TrackCache.update(), which then provides the intercept windows
+
+    def asset_count(self):
+        return len(self.asset_names)
+
+    def track_count(self):
+        return len(self.track_ids)
+
+    # (assets, weapon types) mask of the weapons that can fire this tick
+    def can_fire(self):
+        return self.ready & (self.ammo > 0)
+
+    # True if any ship has any ammo left
+    def weapons_are_available(self):
+        return bool(self.ammo.any())
+
+    # (tracks, assets) distance, closing speed and time to impact matrices, see impact_matrices below.
+    # Calculated once per snapshot and shared by every caller.
+    def impact_matrices(self):
+        if self.impacts is None:
+            self.impacts = impact_matrices(self.track_positions, self.track_velocities, self.asset_positions)
+        return self.impacts
+
+    # (assets, assets) horizontal distance between our ships
+    def ship_distances(self):
+        if self.ship_distance is None:
+            offsets = self.asset_positions[:, None, 0:2] - self.asset_positions[None, :, 0:2]
+            self.ship_distance = np.sqrt(np.einsum('ijk,ijk->ij', offsets, offsets))
+        return self.ship_distance
+
+    # (primary, secondary) target index of every track, see target_assignment below
+    def target_assignment(self):
+        if self.targets is None:
+            distance, _, _ = self.impact_matrices()
+            self.targets = target_assignment(distance, self.ship_distances())
+        return self.targets
+
+    # (earliest, latest) intercept windows of every track and weapon, see trajectory.intercept_windows.
+    # earliest is (tracks, assets, weapon types) with columns in WEAPON_TYPES order.
+    # With a TrackCache they come from its per TrackId coefficients, which are only recalculated for tracks that
+    # changed course. trajectory.py only has to ship with the clients that call this (or cull_tracks).
+    def intercept_windows(self):
+        if self.windows is None:
+            primary, _ = self.target_assignment()
+            if self.track_cache is not None:
+                self.windows = self.track_cache.intercept_windows(self, primary)
+            else:
+                import trajectory
+                self.windows = trajectory.intercept_windows(self.track_positions, self.track_velocities,
+                                                            self.asset_positions, primary, WEAPON_SPEEDS)
+        return self.windows
+
+    # Threat culling pre-pass, run once per tick before the strategies search. Returns compact index arrays of
+    #   threats: tracks not in the blacklist that can reach a living ship before the scenario ends
+    #   candidates: the threats one of the given weapons (default: ready and loaded) can intercept before they
+    #   reach their primary target and before the scenario ends
+    # weapons is an (assets, weapon types) mask, e.g. self.ammo > 0 to plan for weapons that are still reloading
+    def cull_tracks(self, blacklist, weapons: np.ndarray = None):
+        if weapons is None:
+            weapons = self.can_fire()
+        time_left = SCENARIO_LENGTH - self.time
+
+        _, _, time_to_impact = self.impact_matrices()
+        living = self.asset_health > 0
+        threats = self.unengaged(blacklist) & (time_to_impact[:, living] < time_left).any(axis=1)
+
+        earliest, latest = self.intercept_windows()
+        in_time = (earliest <= latest[:, None, None]) & (earliest < time_left) & weapons
+        candidates = threats & in_time.any(axis=(1, 2))
+        return np.flatnonzero(threats), np.flatnonzero(candidates)
+
+    # Mask of the tracks whose TrackId is not in the blacklist
+    def unengaged(self, blacklist):
+        if not blacklist:
+            return np.ones(len(self.track_ids), dtype=bool)
+        return ~np.isin(self.track_ids, list(blacklist))
+
+
+# Returns the (tracks, assets) matrices of
+#   distance: horizontal missile -> ship distance, like utils.distance_between_missile_and_ship
+#   closing_speed: how fast that distance shrinks, negative while the missile moves away from the ship
+#   time_to_impact: distance / missile speed, the straight line estimate of utils.time_between_missile_and_ship
+# for every missile and ship pair at once
+def impact_matrices(track_positions: np.ndarray, track_velocities: np.ndarray, asset_positions: np.ndarray):
+    offsets = track_positions[:, None, 0:2] - asset_positions[None, :, 0:2]  # (tracks, assets, xy)
+    distance = np.sqrt(np.einsum('ijk,ijk->ij', offsets, offsets))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        closing_speed = -np.einsum('ijk,ik->ij', offsets, track_velocities[:, 0:2]) / distance
+        closing_speed[distance == 0] = 0.0
+
+        speed = np.linalg.norm(track_velocities, axis=1)
+        time_to_impact = distance / speed[:, None]
+    return distance, closing_speed, time_to_impact
+
+
+# Returns the primary and secondary target (asset index) of every track, as utils.find_primary_target and
+# utils.find_secondary_target define them: the primary target is the closest ship, the secondary target is
+# the ship closest to the primary one, which the missile goes for once its primary target is destroyed.
+# Secondary is -1 when there is no other ship.
+#   distance: (tracks, assets) missile -> ship distance, ship_distance: (assets, assets) ship -> ship distance
+def target_assignment(distance: np.ndarray, ship_distance: np.ndarray):
+    tracks, assets = distance.shape
+    if assets == 0:
+        return np.full(tracks, -1), np.full(tracks, -1)
+
+    primary = np.argpartition(distance, 0, axis=1)[:, 0]
+
+    # a ship (or one at the very same spot) is never its own secondary
+    others = np.where(ship_distance > 0, ship_distance, np.inf)
+    closest_other = np.argpartition(others, 0, axis=1)[:, 0]
+    closest_other[np.isinf(others.min(axis=1))] = -1
+
+    return primary, closest_other[primary]
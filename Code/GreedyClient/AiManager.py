@@ -4,7 +4,12 @@ from PlannerProto_pb2 import ErrorPb
 from PlannerProto_pb2 import StatePb, AssetPb, TrackPb                          #Simulation state information
 from PlannerProto_pb2 import OutputPb, ShipActionPb,  WeaponPb
 from publisher import Publisher
+from state_snapshot import StateSnapshot, WEAPON_TYPES, WEAPON_SPEEDS
+from track_cache import TrackCache
+from wta import assign_weapons
+from threat_ranker import ThreatRanker, danger_levels
 
+import numpy as np
 import random
 import utils
 
@@ -31,8 +36,9 @@ class AiManager:
     def __init__(self, publisher:Publisher):
         print("Constructing AI Manager")
         self.ai_pub = publisher
-        self.track_danger_levels = None
+        self.threat_ranker = ThreatRanker() # unengaged tracks of the current StatePb by danger level
         self.blacklist = set()
+        self.track_cache = TrackCache() # track geometry kept between StatePbs
 
         self.logfile = None
 
@@ -64,6 +70,8 @@ class AiManager:
     # This method/message is used to nofify that a scenario/run has ended
     def receiveScenarioConcludedNotificationPb(self, msg:ScenarioConcludedNotificationPb):
         self.blacklist = set()
+        self.threat_ranker.reset()
+        self.track_cache.reset()
         if msg.score != 10000:
             print("Ended Run: " + str(msg.sessionId) + " with score: " + str(msg.score))
         self.logfile.close()
@@ -87,27 +95,39 @@ class AiManager:
         # As stated, shipActions go into the OutputPb as a list of ShipActionPbs
         # output_message.actions.append(ship_action)
 
+        # decode the StatePb once for the strategies, only tracks that changed course get their geometry recalculated
+        snapshot = StateSnapshot(msg)
+        self.track_cache.update(snapshot)
+
         #force it to use one or the other
-        switch = True
-        if switch:
-            output_message.actions.extend(self.low_resources_strategy(msg))
+        #2 - optimal weapon-target assignment, every ready weapon may fire
+        #1 - low resources
+        #0 - simple greedy
+        #every ready weapon may fire once per timestep, at most one weapon per missile
+        switch = 1
+        if switch == 2:
+            output_message.actions.extend(self.optimal_WTA_strategy(msg, snapshot))
+        elif switch == 1:
+            output_message.actions.extend(self.low_resources_strategy(msg, snapshot))
         else:
-            output_message.actions.extend(self.simple_greedy_strategy(msg))
+            output_message.actions.extend(self.simple_greedy_strategy(msg, snapshot))
 
         self.saveStateInfoToFile(msg)
 
         return output_message
 
     
-    def simple_greedy_strategy(self, msg:StatePb):
+    def simple_greedy_strategy(self, msg:StatePb, snapshot:StateSnapshot):
         """
         Greedy target selection based on distance of enemy missile to any asset
 
-        Only one weapon is used per timestep.
+        Every ready weapon may fire once per timestep: the most dangerous missiles are engaged first,
+        each from the closest ship that still has a ready weapon.
 
         Parameters
         ----------
         msg: StatePb - received data from the planner
+        snapshot: StateSnapshot - msg decoded into arrays
 
         Returns
         -------
@@ -119,83 +139,51 @@ class AiManager:
         TARGETING_CUTOFF = 0.2
         MAX_DANGER = 100
            
-        # list of (danger value, enemy missile info.) tuples
-        self.track_danger_levels = []
-        
-        # assign a danger level for each incoming threat and have the threats sorted from most to least dangerous
+        # danger level of every unengaged hostile track, ranked by self.threat_ranker
         # Danger level is based on the summed distance to all of our assets
         print(msg.Tracks)
-        for track in msg.Tracks:
-            if track.ThreatRelationship == "Hostile" and track.TrackId not in self.blacklist:
-                # calculate danger value for current track
-                danger_metric = MAX_DANGER
-                for asset in msg.assets:
-                    danger_metric -= utils.distance(asset.PositionX, asset.PositionY, asset.PositionZ, track.PositionX, track.PositionY, track.PositionZ) / DANGER_DISTANCE_SCALE
-                
-                # insert in sorted order
-                loc = 0
-                while loc < len(self.track_danger_levels) - 1 and danger_metric < self.track_danger_levels[0][0]:
-                    loc += 1
-                self.track_danger_levels.insert(loc, (danger_metric, track)) if loc < len(self.track_danger_levels) - 1 else self.track_danger_levels.append((danger_metric, track))
-
-        # print(self.track_danger_levels)
-        
-        # if there are any threat and we have weapons
-        # and the most dangerous threat value > MAX_DANGER * TARGETING_CUTOFF
-        if len(self.track_danger_levels) > 0  and self.weapons_are_available(msg.assets):
-            
-            # generate list of our defense ships that aren't targeting and have any weapons left
-            unassigned_assets = []
-            for asset in msg.assets:
-                if asset.AssetName != "Galleon_REFERENCE_SHIP" and self.weapons_in_asset(asset):
-                    unassigned_assets.append(asset)
-
-                    
-            # find closest (s_dist) asset (s_ass) to danger through comparisons
-            
-            # compare to the first asset
-            s_ass = unassigned_assets[0]
-            most_danger_threat = self.track_danger_levels[0][1]
-            
-            s_dist = utils.distance(s_ass.PositionX, s_ass.PositionY, s_ass.PositionZ, 
-                                    most_danger_threat.PositionX, most_danger_threat.PositionY, most_danger_threat.PositionZ)
-            
-            # comparisons
-            for asset in unassigned_assets:
-                asset_dist = utils.distance(asset.PositionX, asset.PositionY, asset.PositionZ, 
-                                        most_danger_threat.PositionX, most_danger_threat.PositionY, most_danger_threat.PositionZ)
-                if asset_dist < s_dist:
-                    s_dist = asset_dist
-                    s_ass = asset
+        hostile = {track.TrackId: track for track in msg.Tracks
+                   if track.ThreatRelationship == "Hostile" and track.TrackId not in self.blacklist}
+        track_positions = np.array([(track.PositionX, track.PositionY, track.PositionZ) for track in hostile.values()]).reshape(-1, 3)
+        asset_positions = np.array([(asset.PositionX, asset.PositionY, asset.PositionZ) for asset in msg.assets]).reshape(-1, 3)
+        dangers = danger_levels(track_positions, asset_positions, MAX_DANGER, DANGER_DISTANCE_SCALE)
+        self.threat_ranker.update_all(np.fromiter(hostile, dtype=np.int64, count=len(hostile)), dangers)
+
+        # ready and loaded weapons that have not been given a target yet this timestep
+        free = snapshot.can_fire()
+
+        # one missile per free weapon, from the most dangerous down
+        ship_actions = []
+        for track_id, _ in self.threat_ranker.top_k(int(free.sum())):
+            most_danger_threat = hostile[track_id]
+
+            # closest ship (s_ass) to the threat that still has a free weapon
+            shooters = np.flatnonzero(free.any(axis=1))
+            threat_position = snapshot.track_positions[snapshot.track_index[track_id]]
+            s_ass = shooters[np.linalg.norm(snapshot.asset_positions[shooters] - threat_position, axis=1).argmin()]
+
+            # random weapon selection among its free ones
+            weapon = random.choice(np.flatnonzero(free[s_ass]))
+            free[s_ass, weapon] = False
 
             # send a response back to the planner
-            
             ship_action: ShipActionPb = ShipActionPb()
-            ship_action.TargetId = most_danger_threat.TrackId       
-            ship_action.AssetName = s_ass.AssetName
+            ship_action.TargetId = most_danger_threat.TrackId
+            ship_action.AssetName = snapshot.asset_names[s_ass]
+            ship_action.weapon = WEAPON_TYPES[weapon]
+            ship_actions.append(ship_action)
 
             self.blacklist.add(most_danger_threat.TrackId)
+            self.threat_ranker.remove(most_danger_threat.TrackId)
 
-            # random weapon selection, but it may not be ready or there may not be any left
-            rand_weapon = random.choice(s_ass.weapons)
-
-            # therefore, randomly scurry around until we have an immediate weapon to launch
-            while rand_weapon.Quantity == 0 or rand_weapon.WeaponState != "Ready":
-                rand_weapon = random.choice(s_ass.weapons)
-
-            ship_action.weapon = rand_weapon.SystemName
+        return ship_actions
         
-            return [ship_action]
 
-        else:
-            return []
-        
-
-    def low_resources_strategy(self, msg:StatePb):
+    def low_resources_strategy(self, msg:StatePb, snapshot:StateSnapshot):
         """
         Low resources strategy: goal is to preserve ships from dying
 
-        Only one weapon is used per timestep.
+        Every ready weapon may fire once per timestep, each at a different missile.
 
         Strategy: wait for missiles to spawn, calculate number of missiles aimed at each ship, blow up
         closest missile targeting the most-targeted ship
@@ -203,81 +191,121 @@ class AiManager:
         Parameters
         ----------
         msg: StatePb - received data from the planner
+        snapshot: StateSnapshot - msg decoded into arrays
 
         Returns
         -------
         list[ShipAction], each ShipAction indicating a weapon-target assignment
         """
         #How long should we wait before acting? (Step 1: Wait before spawn)
-    
-        targets_list = []
-        missile_dict = {}
-        #Are there any valid targets (hostile, not in blacklist)?
-        for track in msg.Tracks:
-            if track.ThreatRelationship == "Hostile" and track.TrackId not in self.blacklist:
-                targets_list.append(track)
-                missile_dict[track.TrackId] = track
 
+        #Are there any valid targets (hostile, not in blacklist, a ready weapon can get to them in time)?
+        threats, targets = snapshot.cull_tracks(self.blacklist)
 
         # if there are any threats and we have weapons and we are past the time threshold
-        if self.weapons_are_available(msg.assets) and targets_list:
+        if snapshot.weapons_are_available() and len(targets) > 0:
             
-            # generate list of our defense ships that aren't targeting and have any weapons left
-            unassigned_assets = []
-            total_assets = [] # List of all of our ships
-            assets_dict = {} #Dictionary mapping asset names to the assets themselves
-            for asset in msg.assets:
-                if asset.AssetName != "Galleon_REFERENCE_SHIP":
-                    total_assets.append(asset)
-                    if self.weapons_in_asset(asset):
-                        unassigned_assets.append(asset)
-                    assets_dict[asset.AssetName] = asset
-
-                    
+            missile_dict = {} #Maps track ids to the missiles themselves
             targeted_ships_dict = {} #Maps an asset to a list of the missiles targeting it
             missile_target_dict = {} #Maps a missile name to the ship it's attacking
 
             #Calculate what ships every missile is targeting
-            for enemy_missile in targets_list:
-                utils.smart_calculate_missile_target(enemy_missile,total_assets,targeted_ships_dict, missile_target_dict)
-            
-            expected_value_dict = {} # Maps missile name to expected value
-            print(missile_target_dict)
-            for missileName in missile_dict.keys():
-                closest_ready_asset = utils.find_closest_ready_asset(missile_dict[missileName],unassigned_assets)
-                for weapon in closest_ready_asset.weapons: 
-                    if weapon.WeaponState == "Ready":
-                        print(missileName,missile_target_dict.keys())
-                        if utils.time_between_ships(closest_ready_asset, missile_target_dict[missileName], weapon) < utils.time_between_missile_and_ship(missile_dict[missileName], missile_target_dict[missileName]):
-                            expected_value_dict[missileName] = utils.expected_value(missile_dict[missileName], targeted_ships_dict, missile_target_dict)
-                    
-            #find the missile with the highest expected value
-            max_missile_id = max(expected_value_dict, key = expected_value_dict.get)
-            closest_ready_asset = utils.find_closest_ready_asset(missile_dict[max_missile_id],unassigned_assets)
-            # send a response back to the planner
-            
-            ship_action: ShipActionPb = ShipActionPb()
-            ship_action.TargetId = max_missile_id
-            ship_action.AssetName = closest_ready_asset.AssetName
-
-            self.blacklist.add(max_missile_id)
+            for j in threats:
+                missile_dict[int(snapshot.track_ids[j])] = snapshot.tracks[j]
+            utils.smart_calculate_missile_targets(snapshot, threats, targeted_ships_dict, missile_target_dict)
+            _, secondary = snapshot.target_assignment()
 
-            # random weapon selection, but it may not be ready or there may not be any left
-            rand_weapon = random.choice(closest_ready_asset.weapons)
-
-            # therefore, randomly scurry around until we have an immediate weapon to launch
-            while rand_weapon.Quantity == 0 or rand_weapon.WeaponState != "Ready":
-                rand_weapon = random.choice(closest_ready_asset.weapons)
-
-            ship_action.weapon = rand_weapon.SystemName
-            
-            self.saveStateInfoToFile(msg)
+            distance, _, time_to_impact = snapshot.impact_matrices()
+            # (assets, assets) horizontal distance between our ships, for the time our weapons take to reach the ship under attack
+            ship_distance = snapshot.ship_distances()
 
-            return [ship_action]
+            expected_value_dict = {} # Maps missile name to expected value
+            for j in targets:
+                missileName = int(snapshot.track_ids[j])
+                secondary_target = snapshot.assets[secondary[j]] if secondary[j] >= 0 else None
+                expected_value_dict[missileName] = utils.expected_value(missile_dict[missileName], targeted_ships_dict, missile_target_dict, secondary_target)
+
+            # ready and loaded weapons that have not been given a target yet this timestep
+            free = snapshot.can_fire()
+
+            #engage the missiles from the highest expected value down, each from the closest ship with a free
+            #weapon that reaches the ship under attack before the missile does
+            ship_actions = []
+            for missileName in sorted(expected_value_dict, key = expected_value_dict.get, reverse = True):
+                if not free.any():
+                    break
+                j = snapshot.track_index[missileName]
+                target_ship = snapshot.asset_index[missile_target_dict[missileName].AssetName]
+                in_time = free & (ship_distance[:, target_ship, None] / WEAPON_SPEEDS < time_to_impact[j, target_ship])
+                shooters = np.flatnonzero(in_time.any(axis=1))
+                if len(shooters) == 0:
+                    continue
+                shooter = shooters[distance[j, shooters].argmin()]
+
+                # random weapon selection among the ones that are free and in time
+                weapon = random.choice(np.flatnonzero(in_time[shooter]))
+                free[shooter, weapon] = False
+
+                # send a response back to the planner
+                ship_action: ShipActionPb = ShipActionPb()
+                ship_action.TargetId = missileName
+                ship_action.AssetName = snapshot.asset_names[shooter]
+                ship_action.weapon = WEAPON_TYPES[weapon]
+                ship_actions.append(ship_action)
+
+                self.blacklist.add(missileName)
+
+            return ship_actions
         else:
             return []
         
     
+    def optimal_WTA_strategy(self, msg:StatePb, snapshot:StateSnapshot):
+        """
+        Optimal Weapon-Target assignments strategy
+
+        Every missile is worth its expected value (same as in low_resources_strategy) to every ready weapon
+        that can intercept it before it reaches its target. The assignment with the highest total value is
+        fired this timestep, one weapon per missile and at most one shot per weapon.
+
+        Parameters
+        ----------
+        msg: StatePb - received data from the planner
+        snapshot: StateSnapshot - msg decoded into arrays
+
+        Returns
+        -------
+        list[ShipAction], each ShipAction indicating a weapon-target assignment
+        """
+        # missiles a ready weapon can intercept in time
+        threats, targets = snapshot.cull_tracks(self.blacklist)
+        if len(targets) == 0:
+            return []
+
+        targeted_ships_dict = {} #Maps an asset to a list of the missiles targeting it
+        missile_target_dict = {} #Maps a missile name to the ship it's attacking
+        utils.smart_calculate_missile_targets(snapshot, threats, targeted_ships_dict, missile_target_dict)
+        _, secondary = snapshot.target_assignment()
+        earliest, latest = snapshot.intercept_windows()
+
+        # (targets, assets, weapon types) value of each shot, -inf for the ones that arrive too late
+        values = np.full((len(targets), snapshot.asset_count(), len(WEAPON_TYPES)), -np.inf)
+        for row, j in enumerate(targets):
+            secondary_target = snapshot.assets[secondary[j]] if secondary[j] >= 0 else None
+            value = utils.expected_value(snapshot.tracks[j], targeted_ships_dict, missile_target_dict, secondary_target)
+            values[row][earliest[j] <= latest[j]] = value
+
+        ship_actions = []
+        for row, shooter, weapon in assign_weapons(values, snapshot.ammo, snapshot.ready):
+            ship_action: ShipActionPb = ShipActionPb()
+            ship_action.TargetId = int(snapshot.track_ids[targets[row]])
+            ship_action.AssetName = snapshot.asset_names[shooter]
+            ship_action.weapon = WEAPON_TYPES[weapon]
+            ship_actions.append(ship_action)
+            self.blacklist.add(ship_action.TargetId)
+
+        return ship_actions
+
     def random_WTA_strategy(self, msg:StatePb):
         """
         Random Weapon-Target assignments strategy
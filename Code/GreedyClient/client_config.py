@@ -0,0 +1,70 @@
+import zmq
+import zmq.asyncio
+
+# Connection and socket tuning settings shared by the Publisher, Subscriber and AsyncRuntime.
+# The defaults are the Planner's endpoints and libzmq's own socket defaults; change them per deployment in main.py.
+class ClientConfig:
+
+    # Constructor
+    def __init__(self,
+                 publish_endpoint: str = "tcp://127.0.0.1:8885",  # where OutputPbs are sent to the Planner
+                 state_endpoint: str = "tcp://127.0.0.1:8886",  # where the Planner publishes StatePbs etc.
+                 io_threads: int = 1,  # zmq background IO threads of the shared context
+                 rcvhwm: int = 1000,  # max. messages queued on the state socket before new ones are dropped
+                 sndhwm: int = 1000,  # max. messages queued on the publish socket before new ones are dropped
+                 conflate: bool = False,  # keep only the newest message on the state socket
+                 immediate: bool = False,  # only queue messages once the connection is actually up
+                 linger: int = -1,  # ms to wait for unsent messages when closing, -1 waits forever
+                 tcp_keepalive: int = -1):  # 1 enables TCP keepalive, 0 disables it, -1 keeps the OS default
+        self.publish_endpoint = publish_endpoint
+        self.state_endpoint = state_endpoint
+        self.io_threads = io_threads
+        self.rcvhwm = rcvhwm
+        self.sndhwm = sndhwm
+
+        # NOTE: CONFLATE applies to every message on the socket, so it can also drop scenario start/end
+        # notifications. Prefer Subscriber(latest_state_only=True) unless you only care about the latest state.
+        self.conflate = conflate
+
+        # libzmq already sets TCP_NODELAY on all of its TCP connections, these are the latency knobs left
+        self.immediate = immediate
+        self.linger = linger
+        self.tcp_keepalive = tcp_keepalive
+
+    # Creates and connects the PUB socket used to send messages to the Planner
+    def publish_socket(self, context: zmq.Context):
+        socket = context.socket(zmq.PUB)
+        self.apply_common_options(socket)
+        socket.setsockopt(zmq.SNDHWM, self.sndhwm)
+        socket.connect(self.publish_endpoint)
+        return socket
+
+    # Creates, connects and subscribes the SUB socket the Planner's messages are received on
+    def state_socket(self, context: zmq.Context):
+        socket = context.socket(zmq.SUB)
+        self.apply_common_options(socket)
+        socket.setsockopt(zmq.RCVHWM, self.rcvhwm)
+        if self.conflate:
+            socket.setsockopt(zmq.CONFLATE, 1)
+        socket.connect(self.state_endpoint)
+        socket.subscribe("")
+        return socket
+
+    # Options have to be set before connecting
+    def apply_common_options(self, socket):
+        socket.setsockopt(zmq.LINGER, self.linger)
+        socket.setsockopt(zmq.IMMEDIATE, int(self.immediate))
+        socket.setsockopt(zmq.TCP_KEEPALIVE, self.tcp_keepalive)
+
+
+DEFAULT_CONFIG = ClientConfig()
+
+
+# Returns the zmq.Context shared by every socket in this process.
+# The first call decides the number of IO threads. With use_asyncio, an asyncio wrapper
+# around the same context is returned, so blocking and asyncio sockets still share one context.
+def shared_context(config: ClientConfig = DEFAULT_CONFIG, use_asyncio: bool = False):
+    context = zmq.Context.instance(io_threads=config.io_threads)
+    if use_asyncio:
+        return zmq.asyncio.Context.shadow(context.underlying)
+    return context
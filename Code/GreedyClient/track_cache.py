@@ -0,0 +1,138 @@
+import numpy as np
+from state_snapshot import StateSnapshot, target_assignment, WEAPON_SPEEDS
+from trajectory import approach_coefficients, closest_approach_times, intercept_times
+
+# A track's cached geometry is recalculated once its observed state strays this far from the one it was calculated for
+POSITION_TOLERANCE = 1.0  # m between the observed position and the one extrapolated at constant velocity
+VELOCITY_TOLERANCE = 0.5  # m/s change of any velocity component
+
+
+# Keeps the geometry of every track between StatePbs in a table keyed by TrackId, so each tick only recalculates
+# the tracks that are new or changed course instead of all of them:
+#   self.track_cache = TrackCache()       # once, reset() at the end of a scenario
+#   self.track_cache.update(snapshot)     # every StatePb, before anything reads snapshot.impact_matrices()
+#   self.track_cache.new_tracks, .vanished_tracks, .changed
+# update() also makes the snapshot's intercept_windows() come from the table, see intercept_windows below.
+# While a track keeps flying at constant velocity its squared horizontal distance to a ship is the quadratic
+#   c + b * t + a * t^2  (t: seconds since calculated_at, see trajectory.py)
+# so only the coefficients are cached, and update() evaluates them at the snapshot's time to fill its
+# impact_matrices(). A track whose position or velocity no longer matches its cached row (see the tolerances
+# above) gets new coefficients, so the cached values never drift further than POSITION_TOLERANCE.
+# target_assignment() is picked again from those distances on every update, the closest ship changes as a track
+# flies even when its course does not.
+class TrackCache:
+
+    # Constructor
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # one row per track of the last snapshot, in its track order
+        self.track_ids = np.zeros(0, dtype=int)
+        self.positions = np.zeros((0, 3))  # track state each row was calculated for
+        self.velocities = np.zeros((0, 3))
+        self.calculated_at = np.zeros(0)
+        self.horizontal = (np.zeros(0), np.zeros((0, 0)), np.zeros((0, 0)))  # dims=2 (a, b, c) coefficients
+        self.straight = (np.zeros(0), np.zeros((0, 0)), np.zeros((0, 0)))  # dims=3 ones, for intercept windows
+        self.closest_at = np.zeros((0, 0))  # (tracks, assets) time each track is closest to each ship
+        self.asset_positions = None  # ship positions the rows were calculated against
+
+        self.new_tracks = np.zeros(0, dtype=int)  # TrackIds first seen in the last update
+        self.vanished_tracks = np.zeros(0, dtype=int)  # TrackIds of the previous update missing from the last one
+        self.changed = np.zeros(0, dtype=bool)  # per track of the last snapshot: was it recalculated
+
+    # Returns the row of every TrackId in the previous update, -1 for the ones it did not have
+    def previous_rows(self, track_ids: np.ndarray):
+        if len(self.track_ids) == 0:
+            return np.full(len(track_ids), -1)
+        order = np.argsort(self.track_ids)
+        sorted_ids = self.track_ids[order]
+        found = np.minimum(np.searchsorted(sorted_ids, track_ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[found] == track_ids, order[found], -1)
+
+    # Moves the rows of the TrackIds that are still there to their row in the new track order (previous[j] >= 0),
+    # the other rows are filled in by update()
+    def reorder(self, previous: np.ndarray, known: np.ndarray, assets: int):
+        tracks = len(previous)
+        columns = (self.positions, self.velocities, self.calculated_at) + self.horizontal + self.straight
+        columns += (self.closest_at,)
+        coefficients = ((tracks,), (tracks, assets), (tracks, assets))
+        shapes = ((tracks, 3), (tracks, 3), (tracks,)) + coefficients + coefficients + ((tracks, assets),)
+        reordered = tuple(np.zeros(shape) for shape in shapes)
+        if known.any():
+            for new, old in zip(reordered, columns):
+                new[known] = old[previous[known]]
+        self.positions, self.velocities, self.calculated_at = reordered[0:3]
+        self.horizontal, self.straight = reordered[3:6], reordered[6:9]
+        self.closest_at = reordered[9]
+
+    # Mask of the rows whose track is no longer where its row says it should be, or changed its velocity
+    def stale_rows(self, snapshot: StateSnapshot):
+        elapsed = (snapshot.time - self.calculated_at)[:, None]
+        drift = snapshot.track_positions - (self.positions + self.velocities * elapsed)
+        turned = np.abs(snapshot.track_velocities - self.velocities).max(axis=1, initial=0.0) > VELOCITY_TOLERANCE
+        return turned | (np.einsum('ij,ij->i', drift, drift) > POSITION_TOLERANCE * POSITION_TOLERANCE)
+
+    # Brings the table up to date with snapshot and hands the derived values to it
+    def update(self, snapshot: StateSnapshot):
+        track_ids = snapshot.track_ids
+        ships_moved = self.asset_positions is None or not np.array_equal(self.asset_positions, snapshot.asset_positions)
+
+        if not ships_moved and np.array_equal(track_ids, self.track_ids):
+            # the usual tick: the same tracks in the same order, the rows are updated in place
+            self.new_tracks = self.vanished_tracks = np.zeros(0, dtype=int)
+            stale = self.stale_rows(snapshot)
+        else:
+            previous = self.previous_rows(track_ids)
+            self.new_tracks = track_ids[previous < 0]
+            self.vanished_tracks = np.setdiff1d(self.track_ids, track_ids)
+            if ships_moved:
+                previous[:] = -1  # every distance changed with the ships
+            known = previous >= 0
+            self.reorder(previous, known, snapshot.asset_count())
+            self.track_ids = track_ids.copy()
+            stale = ~known
+            stale[known] = self.stale_rows(snapshot)[known]
+
+        rows = np.flatnonzero(stale)
+        if len(rows) > 0:
+            self.positions[rows] = snapshot.track_positions[rows]
+            self.velocities[rows] = snapshot.track_velocities[rows]
+            self.calculated_at[rows] = snapshot.time
+            for coefficients, dims in ((self.horizontal, 2), (self.straight, 3)):
+                for array, values in zip(coefficients, approach_coefficients(snapshot.track_positions[rows],
+                                                                             snapshot.track_velocities[rows],
+                                                                             snapshot.asset_positions, dims)):
+                    array[rows] = values
+            a, b, _ = self.horizontal
+            self.closest_at[rows] = snapshot.time + closest_approach_times(a[rows], b[rows])
+        if ships_moved:
+            self.asset_positions = snapshot.asset_positions.copy()
+        self.changed = stale
+
+        # values as of snapshot.time, the same as impact_matrices() returns up to POSITION_TOLERANCE
+        a, b, c = self.horizontal
+        t = (snapshot.time - self.calculated_at)[:, None]
+        distance = np.sqrt(np.maximum(c + b * t + a[:, None] * t * t, 0.0))
+        speed = np.linalg.norm(snapshot.track_velocities, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            closing_speed = -(b / 2 + a[:, None] * t) / distance
+            closing_speed[distance == 0] = 0.0
+            time_to_impact = distance / speed[:, None]
+
+        snapshot.impacts = (distance, closing_speed, time_to_impact)
+        snapshot.targets = target_assignment(distance, snapshot.ship_distances())
+        snapshot.track_cache = self
+
+    # Returns the snapshot's (earliest, latest) intercept windows, the same as trajectory.intercept_windows up to
+    # POSITION_TOLERANCE, from the cached coefficients instead of the track positions. Only valid for the snapshot
+    # of the last update.
+    # The coefficients are on the clock of calculated_at, so a weapon fired now is fired `elapsed` seconds into it.
+    def intercept_windows(self, snapshot: StateSnapshot, primary: np.ndarray):
+        elapsed = snapshot.time - self.calculated_at
+        earliest = intercept_times(*self.straight, elapsed, WEAPON_SPEEDS) - elapsed[:, None, None]
+
+        latest = np.full(len(primary), -np.inf)
+        if snapshot.asset_count() > 0:
+            latest = self.closest_at[np.arange(len(primary)), primary] - snapshot.time
+        return earliest, latest
@@ -0,0 +1,71 @@
+import numpy as np
+
+# Constant velocity prediction of the hostile tracks: a track at position p flying at velocity v is at p + v * t
+# t seconds later. The squared distance between a predicted track and a ship is then a quadratic of t,
+#   |p + v * t - ship|^2 = c + b * t + a * t^2
+# and everything below is solved from those coefficients. Climbs and dives show up as velocity changes, so the
+# predictions only hold until the next StatePb.
+
+
+# Returns the positions of the tracks `seconds` from now, seconds is a number or one per track
+def predict_positions(track_positions: np.ndarray, track_velocities: np.ndarray, seconds):
+    return track_positions + track_velocities * np.reshape(seconds, (-1, 1))
+
+
+# Returns the coefficients a (tracks,), b and c (tracks, assets) of the squared track -> ship distance.
+#   dims: 2 for the horizontal distance the strategies compare, 3 for the straight line a weapon flies
+def approach_coefficients(track_positions: np.ndarray, track_velocities: np.ndarray, asset_positions: np.ndarray,
+                          dims: int = 3):
+    offsets = track_positions[:, None, 0:dims] - asset_positions[None, :, 0:dims]  # (tracks, assets, dims)
+    velocity = track_velocities[:, 0:dims]
+    a = np.einsum('ik,ik->i', velocity, velocity)
+    b = 2 * np.einsum('ijk,ik->ij', offsets, velocity)
+    c = np.einsum('ijk,ijk->ij', offsets, offsets)
+    return a, b, c
+
+
+# Returns the (tracks, assets) time at which every track is closest to every ship, from dims=2 coefficients.
+# For the ship a track is flying at this is when it hits, -inf for tracks that are not moving.
+def closest_approach_times(a: np.ndarray, b: np.ndarray):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(a[:, None] > 0, -b / (2 * a[:, None]), -np.inf)
+
+
+# Returns the (tracks, assets, weapons) time at which a weapon fired from each ship at time `fired` first meets
+# each track, np.inf if it never catches up.
+#   a, b, c: dims=3 coefficients, fired: a number or one per track, on the same clock as the coefficients
+#   weapon_speeds: m/s per weapon type
+# The weapon meets the track at the first t >= fired with  c + b * t + a * t^2 = (speed * (t - fired))^2
+def intercept_times(a: np.ndarray, b: np.ndarray, c: np.ndarray, fired, weapon_speeds: np.ndarray):
+    squared_speed = np.asarray(weapon_speeds, dtype=float) ** 2
+    fired = np.broadcast_to(np.asarray(fired, dtype=float), a.shape)[:, None, None]
+
+    # k * t^2 + linear * t + constant = 0
+    k = a[:, None, None] - squared_speed
+    linear = b[:, :, None] + 2 * squared_speed * fired
+    constant = c[:, :, None] - squared_speed * fired * fired
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        root = np.sqrt(linear * linear - 4 * k * constant)  # nan without a real solution
+        roots = np.stack(((-linear - root) / (2 * k), (-linear + root) / (2 * k)))
+        roots = np.where(k == 0, -constant / linear, roots)  # a track exactly as fast as the weapon
+
+    roots[~(roots >= fired)] = np.inf
+    return roots.min(axis=0)
+
+
+# Returns the intercept windows of every track as (earliest, latest), in seconds from now:
+#   earliest: (tracks, assets, weapons) when a weapon fired from each ship right now meets the track
+#   latest: (tracks,) when the track reaches its primary target, intercepting after that is no use
+# A ship's weapon can intercept a track if earliest <= latest.
+#   primary: (tracks,) asset index of each track's primary target, see state_snapshot.target_assignment
+def intercept_windows(track_positions: np.ndarray, track_velocities: np.ndarray, asset_positions: np.ndarray,
+                      primary: np.ndarray, weapon_speeds: np.ndarray):
+    earliest = intercept_times(*approach_coefficients(track_positions, track_velocities, asset_positions, 3),
+                               0.0, weapon_speeds)
+
+    latest = np.full(len(primary), -np.inf)
+    if len(asset_positions) > 0:
+        a, b, _ = approach_coefficients(track_positions, track_velocities, asset_positions, 2)
+        latest = closest_approach_times(a, b)[np.arange(len(primary)), primary]
+    return earliest, latest
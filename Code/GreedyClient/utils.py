@@ -37,6 +37,19 @@ def smart_calculate_missile_target(missile : _TRACKPB, asset_list : list[_ASSETP
     else:
         target_dict[closest_asset.AssetName] = [missile]
     missile_target_dict[missile.TrackId] = closest_asset
+
+#Batched version of smart_calculate_missile_target for the given track indices of a StateSnapshot,
+#uses the primary targets of snapshot.target_assignment() instead of scanning the asset list per missile
+def smart_calculate_missile_targets(snapshot, track_indices, target_dict, missile_target_dict):
+    primary, _ = snapshot.target_assignment()
+    for j in track_indices:
+        missile = snapshot.tracks[j]
+        closest_asset = snapshot.assets[primary[j]]
+        if closest_asset.AssetName in target_dict.keys():
+            target_dict[closest_asset.AssetName].append(missile)
+        else:
+            target_dict[closest_asset.AssetName] = [missile]
+        missile_target_dict[missile.TrackId] = closest_asset
     
 #Arguments: missile and list of assets
 #Adds a new entry to the target_dict mapping the asset to a list of the missiles targeting it
@@ -92,9 +105,9 @@ def find_most_targeted_ship(target_dict: dict[str,list[_TRACKPB]]):
     return most_targeted_ship
 
 #Arguments: a missile, the dictionary mapping ships to missiles targeting them
-#The dictionary mapping missiles to their targets
+#The dictionary mapping missiles to their targets, and the missile's secondary target (None if it has none)
 #Returns: the expected value of destroying this missile; want to use distance as a tiebreaker 
-def expected_value(missile : _TRACKPB, target_dict, missile_target_dict):
+def expected_value(missile : _TRACKPB, target_dict, missile_target_dict, secondary_target : _ASSETPB = None):
     target = missile_target_dict[missile.TrackId] #What ship is being targeted
     m_with_same_t = len(target_dict[target.AssetName]) #How many missiles are targeting this target
     distance_between_missile_and_target = distance_between_missile_and_ship(missile,target)
@@ -107,8 +120,7 @@ def expected_value(missile : _TRACKPB, target_dict, missile_target_dict):
         ev = ev + 5000
     else:
         ev = ev + 1000
-    secondary_target = find_secondary_target(missile, list(target_dict.keys()))
-    if secondary_target.isHVU:
+    if secondary_target is not None and secondary_target.isHVU:
         ev = ev + 4500
     return ev
 
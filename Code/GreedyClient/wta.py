@@ -0,0 +1,97 @@
+import numpy as np
+
+# Weapon-target assignment: given the value of shooting every track with every (ship, weapon) pair,
+# pick the set of shots for this tick with the highest total value, where every track is shot at most once
+# and every weapon fires at most shots_per_weapon times (and never more than its ammo).
+#   shots = assign_weapons(values, snapshot.ammo, snapshot.ready)
+#   for track, ship, weapon in shots: ...
+# values is (tracks, assets, weapon types), with -np.inf (or any value <= 0) for shots that should not be taken,
+# e.g. weapons that cannot intercept the track in time.
+
+
+# Returns the (track, asset, weapon) index triples of the best set of shots, in track order
+def assign_weapons(values: np.ndarray, ammo: np.ndarray, ready: np.ndarray, shots_per_weapon: int = 1):
+    # one slot per shot a weapon can take this tick
+    shots = np.where(ready, np.minimum(ammo, shots_per_weapon), 0)
+    slot_asset, slot_weapon = np.nonzero(shots)
+    repeats = shots[slot_asset, slot_weapon]
+    slot_asset, slot_weapon = np.repeat(slot_asset, repeats), np.repeat(slot_weapon, repeats)
+    if len(slot_asset) == 0 or values.shape[0] == 0:
+        return []
+
+    slot_values = values[:, slot_asset, slot_weapon]  # (tracks, slots)
+    wanted = slot_values > 0
+
+    # maximizing the value is minimizing its negative, shots not worth taking cost 0 and are dropped afterwards
+    rows, columns = linear_assignment(np.where(wanted, -slot_values, 0.0))
+    keep = wanted[rows, columns]
+    return [(int(track), int(slot_asset[slot]), int(slot_weapon[slot]))
+            for track, slot in zip(rows[keep], columns[keep])]
+
+
+# Returns the row and column indices of the minimum cost assignment of a (rows, columns) cost matrix,
+# min(rows, columns) pairs sorted by row. Hungarian algorithm with potentials (shortest augmenting paths),
+# O(n^2 m) for n = min(rows, columns), the inner loop over the other side is vectorized.
+def linear_assignment(cost: np.ndarray):
+    cost = np.asarray(cost, dtype=float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    # column 0 is a virtual column the row being added starts from, rows are 1 based in match
+    u = np.zeros(n + 1)  # row potentials
+    v = np.zeros(m + 1)  # column potentials
+    match = np.zeros(m + 1, dtype=int)  # row assigned to each column, 0 if none
+    way = np.zeros(m + 1, dtype=int)  # previous column on the shortest path
+    padded = np.zeros((n + 1, m + 1))
+    padded[1:, 1:] = cost
+
+    # start from every row's cheapest column, which already settles the rows that do not compete for one
+    u[1:] = cost.min(axis=1)
+    matched_rows = []
+    for row, column in enumerate(cost.argmin(axis=1) + 1, start=1):
+        if match[column] == 0:
+            match[column] = row
+            matched_rows.append(row)
+
+    for row in sorted(set(range(1, n + 1)) - set(matched_rows)):
+        match[0] = row
+        column = 0
+        min_reduced = np.full(m + 1, np.inf)  # kept at inf for the columns already on the path
+        blocked = np.zeros(m + 1)  # inf for the columns already on the path
+        path_rows, path_columns = [], []
+        while True:
+            path_rows.append(match[column])
+            path_columns.append(column)
+            min_reduced[column] = np.inf
+            blocked[column] = np.inf
+
+            reduced = padded[match[column]] - v
+            reduced += blocked - u[match[column]]
+            improved = reduced < min_reduced
+            np.copyto(min_reduced, reduced, where=improved)
+            np.copyto(way, column, where=improved)
+
+            next_column = int(min_reduced.argmin())
+            delta = min_reduced[next_column]
+            u[path_rows] += delta
+            v[path_columns] -= delta
+            min_reduced -= delta
+
+            column = next_column
+            if match[column] == 0:
+                break
+
+        # flip the matching along the augmenting path
+        while column:
+            previous = way[column]
+            match[column] = match[previous]
+            column = previous
+
+    columns = np.flatnonzero(match[1:])
+    rows = match[1:][columns] - 1
+    if transposed:
+        rows, columns = columns, rows
+    order = np.argsort(rows)
+    return rows[order], columns[order]
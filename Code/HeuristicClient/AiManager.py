@@ -4,12 +4,25 @@ from PlannerProto_pb2 import ErrorPb
 from PlannerProto_pb2 import StatePb, AssetPb, TrackPb                          #Simulation state information
 from PlannerProto_pb2 import OutputPb, ShipActionPb,  WeaponPb
 from publisher import Publisher
+from state_snapshot import StateSnapshot, WEAPON_TYPES
+from track_cache import TrackCache
+from shot_planner import ShotPlanner
+from timeline import DestructionTimeline
 
+import numpy as np
 import random
 import utils
 
+from time import perf_counter
+
 from datetime import datetime as dt
 
+# Wall-clock seconds full_heuristic_strategy may spend on one StatePb before answering with its best plan so far
+DECISION_BUDGET = 0.5
+
+# Most alternative shot sets (the plan with one threat swapped for another candidate) the timeline compares per StatePb
+MAX_PLAN_SWAPS = 500
+
 # This class is the center of action for this example client.  Its has the required functionality 
 # to receive data from the Planner and send actions back.  Developed AIs can be written directly in here or
 # this class could be used toolbox that a more complex AI classes reference.
@@ -35,6 +48,12 @@ class AiManager:
         self.ai_pub = publisher
         self.track_danger_levels = None
         self.blacklist = set()
+        self.track_cache = TrackCache() # track geometry kept between StatePbs
+
+        self.decision_budget = DECISION_BUDGET
+        self.search_depth = 0 # number of shots planned by the last full_heuristic_strategy search
+        self.search_complete = True # whether that search finished before its deadline
+        self.expected_score = None # expected final score of the plan refine_plan settled on
 
         self.logfile = None
 
@@ -62,6 +81,7 @@ class AiManager:
     # This method/message is used to nofify that a scenario/run has ended
     def receiveScenarioConcludedNotificationPb(self, msg:ScenarioConcludedNotificationPb):
         self.blacklist = set()
+        self.track_cache.reset()
         if msg.score != 10000:
             print("Ended Run: " + str(msg.sessionId) + " with score: " + str(msg.score))
         #self.logfile.close()
@@ -90,10 +110,14 @@ class AiManager:
         #1 - same as low_resources in GreedyClient, only here because I had no reason to remove it
         switch = 2
 
+        # decode the StatePb once for the strategies, only tracks that changed course get their geometry recalculated
+        snapshot = StateSnapshot(msg)
+        self.track_cache.update(snapshot)
+
         if switch == 3:
             output_message.actions.extend(self.testing_strategy(msg))
         elif switch == 2:
-            output_message.actions.extend(self.full_heuristic_strategy(msg))
+            output_message.actions.extend(self.full_heuristic_strategy(msg, snapshot))
         elif switch == 1:
             output_message.actions.extend(self.low_resources_strategy(msg))
         else:
@@ -106,12 +130,9 @@ class AiManager:
         # maps the index to the asset name
         #how the actual hell are we getting the ID?????? JOSEPH: this is how
         #GET ID BY ITS POSITION IN INITIAL INPUT
-        asset_names = [None for _ in range(5)] #unordered list of assets (integer entries, correspond to elements in asset_info, asset_threats)
-        asset_positions = [None] * 5  #len 5, bunch of tuple locations(x, y, z)
-        asset_weapon_info = [None] * 5 # bunch of tuples (name, quantity, WeaponState)
-        # asset_names = [asset.AssetName for asset in msg.assets if 'REFERENCE' not in asset.AssetName]          
-        # self.populate_asset_names(assets)
-        self.populate_asset_info(msg, asset_names, asset_positions, asset_weapon_info)
+        snapshot = StateSnapshot(msg)
+        asset_names = snapshot.asset_names #unordered list of assets (integer entries, correspond to elements in asset_info, asset_threats)
+        asset_positions = snapshot.asset_positions #bunch of locations(x, y, z)
         #USE self.update_assets_trakcs(msg)
 
 
@@ -119,11 +140,10 @@ class AiManager:
 
         # threat_info = [None] * 30 #len 30
 
-        targetIds = [None] * 30 #len 30
-        threat_trackIds = [None] * 30 # for our action outputPb
-        threat_positions = [None] * 30 #list of tuples
-        threat_velocities = [None] * 30 #list of tuples
-        self.populate_threat_info(msg, targetIds, threat_trackIds, threat_positions, threat_velocities)
+        targetIds = snapshot.threat_ids
+        threat_trackIds = snapshot.track_ids # for our action outputPb
+        threat_positions = snapshot.track_positions
+        threat_velocities = snapshot.track_velocities
         # self.populate_threatIds(msg, targetIds, threatIds_to_trackIds)
 
         threat_secondaries = [None] * 5 #len 5
@@ -148,7 +168,7 @@ class AiManager:
         return []
     
     #Strategy based on the most exhaustive and complete set of heuristics we can apply in the time limit
-    def full_heuristic_strategy(self, msg:StatePb):
+    def full_heuristic_strategy(self, msg:StatePb, snapshot:StateSnapshot):
         """
         Pre-implementation notes:
         
@@ -195,58 +215,19 @@ class AiManager:
         2ndary TODO: make a version of the secondary target that works with Nick's existing algorithm
         """
 
-        start = dt.now()
-        # maps the index to the asset name
-        #how the actual hell are we getting the ID?????? JOSEPH: this is how
-        #GET ID BY ITS POSITION IN INITIAL INPUT
-        asset_names = [None for _ in range(5)] #unordered list of assets (integer entries, correspond to elements in asset_info, asset_threats)
-        asset_positions = [None] * 5  #len 5, bunch of tuple locations(x, y, z)
-        asset_HVU_vals = [None] * 5
-        asset_weapon_info = [None] * 5 # each element: list of of tuples (name, quantity, WeaponState)
-        
-        asset_ids = [None] * 5
-        assetPb_list = [None] * 5
-        self.asset_ids(msg, asset_ids, assetPb_list)
-        # asset_names = [asset.AssetName for asset in msg.assets if 'REFERENCE' not in asset.AssetName]          
-        # self.populate_asset_names(assets)
-        self.populate_asset_info(msg, asset_names, asset_positions, asset_weapon_info, asset_HVU_vals)
-        #USE self.update_assets_trakcs(msg)
-
-
-        # threats = [None] * 30 #unordered list of missiles, each entry is an int correstponding to the number of the missile
-
-        # threat_info = [None] * 30 # len 30
-
-
-        targetIds = [None] * 30 #len 30
-        threat_trackIds = [None] * 30 # for our action outputPb
-        threat_positions = [None] * 30
-        threat_velocities = [None] * 30
-        self.populate_threat_info(msg, targetIds, threat_trackIds, threat_positions, threat_velocities)
-
-        # self.populate_threatIds(msg, targetIds, threatIds_to_trackIds)
+        deadline = perf_counter() + self.decision_budget
 
-        threat_secondaries = [None] * 5 #len 5
+        # every index refers to the same asset/threat in all of the snapshot's arrays, the reference ship is left out
+        asset_names = snapshot.asset_names
+        threat_trackIds = snapshot.track_ids.tolist() # for our action outputPb
 
         # list of indices corresponding to the above data structures aka particular missiles
-        # that are active and unaddressed
-        threat_data_lists = [targetIds, threat_trackIds, threat_positions, threat_velocities]
-        filtered_target_indices = self.get_filtered_target_indices(msg, threat_data_lists) #may/maynot need this
-        
-        #STUFF I NEED!!!!!!!!!!!!!!!!!!!
-
-        # used to evaluate when something needs to go to its secondary target
-        # list of list of weapons that are targeting the asset for each respective index?
-        #NEEDS TO BE POPULATED WITH THE MISSILES FOR EACH ASSET THAT HAVE IT AS PRIMARY TARGET (asset identified by index)
-        # uses the `find_primary_target` methods in utils.py
-        asset_threat_list = [[] * 5]
-        self.populate_asset_threat_list(asset_threat_list)
-
+        # that are active and unaddressed, and the ones among them we can shoot down
+        threats, candidates = self.get_filtered_target_indices(snapshot)
+        filtered_target_indices = threats.tolist()
 
-        ammo = utils.total_remaining_ammo(asset_weapon_info)
-
-        delta = dt.now() - start
-        print(f"Initialization time: {delta}")
+        if len(candidates) == 0:
+            return []
 
 
         '''
@@ -266,127 +247,141 @@ class AiManager:
         - NOTE: tiebreakers should be resolved by time to target
 
 
-        For n:
+        n = min(ammo left, number of candidates), then (see anytime_target_search and ShotPlanner):
 
-            For each remaining threat (missiles that are an actual threat):
+            Branch and bound over the sets of n candidates (threats we can still intercept):
 
-                - want to pick the best one to shoot
+                assume we destroy THESE:
 
-                assume we destroy THIS one:
-                
-                    - want to see how this changes the situation
-
-                    find new expected penalty of each missile 
-            
-            add most effective to targets, remove from threats
-
-        '''
+                    find new expected penalty of each missile left
 
-        n = 1 # depth of search
+                skip every set that extends one whose lower bound is no better than the best set so far
 
-        curr_threats = [i for i in filtered_target_indices]
-        best_score = -100000000
-        shotsfired = 0
+            keep the set with the lowest total penalty, or the best one found when the decision budget runs out
 
-        final_target = None
+        Check that set and its one-swap neighbours against the destruction timeline (see refine_plan).
 
-        #final_targets = []
-
-        #NOTE DUE TO TIME CONSTRAINTS STARTING WITH OUTER LOOP 1: ONLY FIRE 1 SHOT
-        for a in range(n): #a in range(threat_filtered) for ALL missiles considered
-            curr_score = -1000000000
-            
-            curr_target = None
-
-            #inner pick-best-target
-            for i in range(len(curr_threats)):
-
-                threat = curr_threats[i]
-
-                inner_threats = curr_threats.copy()
-                inner_threats.remove(threat)
-                inner_target = None
-                
-                #old        #for a in range(ammo - shotsfired):
-                            #    
-                            #    pass
-                            
-                            #NOTE: PSEUDOCODE FOR FINAL STAGE EXPECTED VALUE GREEDY
-                            #   if there are missiles with HVU as target:
-                            #       remove the one that will hit HVU first
-                            #   elif there are missiles with HVU as 2ndary target AND primary target has more missiles inbound than HP:
-                            #       remove the one that will hit 2ndary target first
-                            #   else:
-                            #       remove missile that hits first
-
-
-                #EASY STRAT:
-                #SORT INNER_THREATS BY EXPECTED_VALUE_NEW
-                #remove highest ammo-1 threats
-                #list comp over new version of list
-
-
-                total_score = 0
-                
-                #TODO keep track of final state
-                
-                exp_vals = []
-
-                #for i_threat in inner_threats:
-                idx = 0
-                for assetpb in assetPb_list:
-                    #parsables
-                    primary = (utils.find_primary_target(threat, assetPb_list)).isHVU()
-                    #primary = utils.find_primary_asset_of_enemy(threat_positions[i_threat],asset_positions)
-                    secondary = (utils.find_secondary_target(threat, assetPb_list)).isHVU()#(threat_positions[i_threat], asset_positions)
-                    #primary_HVU = 
-                    #secondary_HVU =
-                    kill_1st = utils.will_be_destroyed(assetpb, asset_threat_list[asset_ids[idx]])
-                    kill_2nd = utils.will_be_destroyed(assetpb, asset_threat_list[asset_ids[idx]])
-                    reach_2nd = utils.can_reach_secondary_target
-                
-                    score = utils.expected_value_new(primary, secondary, kill_1st, kill_2nd, reach_2nd)
-                    idx += 1
-
-
-                #update "current" by best innermost target
-                if total_score > curr_score:
-                    curr_target = i
-                    curr_score = total_score
-
-            #if a < n-1:
-            #    shotsfired += 1
-            #NOTE DUE TO TIME CONSTRAINTS, IGNORE THIS
+        Fire at the threat in the best set that hits first.
+        '''
 
-            final_target = curr_target
-            best_score = curr_score
+        # per threat index: primary and secondary target (asset index) and whether it can retarget to the secondary
+        primary = [None] * snapshot.track_count()
+        secondary = [None] * snapshot.track_count()
+        reach_2nd = [False] * snapshot.track_count()
+        time_to_primary = [None] * snapshot.track_count()
+
+        # per candidate index: (ship index, weapon index, flight time) of every loaded weapon that meets it in time,
+        # weapon indices are columns of snapshot.ammo, i.e. positions in WEAPON_TYPES
+        interceptors = {}
+        loaded = snapshot.ammo > 0
+
+        distance, _, time_to_impact = snapshot.impact_matrices()
+        primaries, secondaries = snapshot.target_assignment()
+        # when a weapon fired now meets each threat, and when the threat reaches its primary target
+        earliest, latest = snapshot.intercept_windows()
+        # a missile can only turn towards a secondary target outside of its turning radius
+        turning_radius = utils.turning_radius(snapshot.track_velocities)
+
+        for i in filtered_target_indices:
+            primary[i] = int(primaries[i])
+            time_to_primary[i] = time_to_impact[i, primary[i]]
+
+            if secondaries[i] >= 0:
+                secondary[i] = int(secondaries[i])
+                reach_2nd[i] = bool(turning_radius[i] < distance[i, secondary[i]])
+
+        for i in candidates.tolist():
+            in_time = loaded & (earliest[i] <= latest[i])
+            interceptors[i] = [(ship_idx, weapon_idx, earliest[i, ship_idx, weapon_idx])
+                               for ship_idx, weapon_idx in zip(*np.nonzero(in_time))]
+
+        # the ones that hit first go first so ties are resolved by time to target
+        candidates = sorted(interceptors, key=lambda i: time_to_primary[i])
+        max_depth = min(int(snapshot.ammo.sum()), len(candidates))
+
+        threat_info = (primary, secondary, reach_2nd, snapshot.asset_HVU.tolist(), snapshot.asset_health.tolist())
+        plan = self.anytime_target_search(filtered_target_indices, candidates, max_depth, deadline, threat_info)
+
+        if plan and perf_counter() < deadline:
+            plan = self.refine_plan(snapshot, filtered_target_indices, candidates, plan, reach_2nd)
+
+        # only fire at threats a weapon is ready for right now, the rest of the plan waits for later StatePbs
+        ready_weapons = {i: [w for w in interceptors[i] if snapshot.ready[w[0], w[1]]] for i in plan}
+        ready_targets = [i for i in plan if ready_weapons[i]]
+        if not ready_targets:
+            return []
 
-            def_ship = utils.find_primary_asset_of_enemy(threat_positions(final_target),asset_positions)
+        final_target = min(ready_targets, key=lambda i: time_to_primary[i])
 
-            #NOTE: THIS IS A TUPLE: (SHIP INDEX, WEAPON INDEX)
-                                                 #- (index in asset_weapon_info) 
-            final_weapon = utils.slowest_avaliable_ship_weapon(final_target, asset_weapon_info, threat_positions(final_target), threat_velocities(final_target), def_ship)
+        # slowest weapon that still makes it in time, the fast ones are saved for threats that need them
+        ship_idx, weapon_idx, _ = max(ready_weapons[final_target], key=lambda w: w[2])
 
+        # sending THE FINAL OUTPUTPB
+        ship_action: ShipActionPb = ShipActionPb()
+        ship_action.AssetName = asset_names[ship_idx]
+        ship_action.TargetId = threat_trackIds[final_target]
+        ship_action.weapon = WEAPON_TYPES[weapon_idx]
 
+        self.blacklist.add(threat_trackIds[final_target])
 
-            ######
-            ######     find optimal weapon to hit best target with if we have time
-            ######
+        return [ship_action]
 
-            # sending THE FINAL OUTPUTPB
+    def anytime_target_search(self, threats, candidates, max_depth, deadline, threat_info):
+        """
+        Search for the threats to shoot next.
+
+        Finds the set of max_depth candidates that leaves the remaining threats with the lowest expected
+        penalty (ShotPlanner.penalty), with ShotPlanner's branch and bound search. If the deadline
+        passes first, the best plan found so far is returned.
+
+        @param threats: indices of every threat still in play
+        @param candidates: indices of the threats we can shoot down, in tiebreak order
+        @param max_depth: most shots worth planning for, at most our remaining ammo
+        @param deadline: perf_counter() value at which the search has to stop
+        @param threat_info: (primary, secondary, reach_2nd, asset_HVU, asset_health), see ShotPlanner
+        @return tuple of threat indices, empty if there is nothing to shoot
+        """
+        planner = ShotPlanner(threats, candidates, threat_info)
+        best_plan = planner.search(max_depth, deadline)
+        self.search_depth = len(best_plan)
+        self.search_complete = not planner.timed_out
 
-            # WEAPON: final_weapon is a tuple of (ship index, weapon index) from asset_weapon_info
-            # TARGET: final_target is from filtered_target_indices
+        return best_plan
 
-            ship_idx, weapon_idx = final_weapon
-
-            ship_action: ShipActionPb = ShipActionPb()
-            ship_action.AssetName = asset_names[ship_idx] 
-            ship_action.TargetId = threat_trackIds[weapon_idx] 
-            ship_action.weapon = asset_weapon_info[ship_idx][weapon_idx]
-            
-            return [ship_action]
 
+    def refine_plan(self, snapshot, threats, candidates, plan, reach_2nd):
+        """
+        The search values threats per class with expected_value_new and does not know when ships go down or which
+        missiles run out of time. The plan and every plan that swaps one of its threats for another candidate are
+        therefore compared on the expected final score of a DestructionTimeline, in one simulate call.
+
+        @param snapshot: the current StatePb decoded into arrays
+        @param threats: indices of every threat still in play
+        @param candidates: indices of the threats we can shoot down
+        @param plan: threats the search picked, a subset of candidates
+        @param reach_2nd: per threat index, whether it can retarget to its secondary target
+        @return the plan with the highest expected score, the search's own one on ties
+        """
+        column = {t: c for c, t in enumerate(threats)}
+        planned = set(plan)
+        swaps = [(out, into) for out in plan for into in candidates if into not in planned][:MAX_PLAN_SWAPS]
+
+        # row 0 is the plan itself, row k swaps[k - 1]
+        shot_sets = np.zeros((len(swaps) + 1, len(threats)), dtype=bool)
+        shot_sets[:, [column[t] for t in plan]] = True
+        for row, (out, into) in enumerate(swaps, 1):
+            shot_sets[row, column[out]] = False
+            shot_sets[row, column[into]] = True
+
+        timeline = DestructionTimeline(snapshot, threats, [reach_2nd[t] for t in threats])
+        _, _, expected_score = timeline.simulate(shot_sets)
+        best = int(np.argmax(expected_score))
+        self.expected_score = float(expected_score[best])
+        if best == 0:
+            return plan
+
+        out, into = swaps[best - 1]
+        return tuple(into if t == out else t for t in plan)
 
     # def populate_asset_names(self, msg: StatePb, init_lst: list):
     #     i = 0
@@ -395,85 +390,26 @@ class AiManager:
     #             init_lst[i] = asset.AssetName
     #             i += 1
     
-    def populate_asset_info(self, msg, names, positions, weapon_info, is_HVU_vals):
-        i = 0
-        for asset in msg.assets:
-            if 'REFERENCE' not in asset.AssetName:
-                names[i] = asset.AssetName
-                positions[i] = (asset.PositionX, asset.PositionY, asset.PositionZ)
-                weapon_info[i] = []
-                is_HVU_vals[i] = asset.isHVU()
-                for w_data in asset.weapons:
-                    weapon_info[i].append((w_data.SystemName, w_data.Quantity, w_data.WeaponState))
-                i += 1
-                
-
-
-    def populate_threat_info(self, msg: StatePb, target_ids, threat_trackIds, threat_poss, threat_velos):
-        """
-        Get mappings from our programmatic threat index to its actual
-        threatId and trackId through two different lists respectively
-        """
-        i = 0
-        for track in msg.Tracks:
-            if track.ThreatRelationship == "Hostile":
-                target_ids[i] = track.ThreatId
-                threat_trackIds[i] = track.TrackId
-                threat_poss[i] = (track.PositionX, track.PositionY, track.PositionZ)
-                threat_velos[i] = (track.VelocityX, track.VelocityY, track.VelocityZ)
-                i += 1
-    
     # def populate_threatIds_to_trackIds(self, msg: StatePb, init_lst: list):
     #     i = 0
     #     for track in msg.Tracks:
     #         init_lst[idx] = ((msg.Tracks[idx]).TrackID)
 
-    def get_filtered_target_indices(self, msg: StatePb, assetPos_lst, threat_data_lists: list[list]):
+    def get_filtered_target_indices(self, snapshot: StateSnapshot):
         """
-        Modifies `threat_data_lists`
-
-        threat_data_lists = [targetIds, threat_trackIds, threat_positions, threat_velocities]
-        These 4 lists have the same length (i.e., 30)
-
         Filters out:
             - already-assigned missiles
-            - missiles that will not reach any of the ships on time
+            - missiles that will not reach any living ship before the scenario ends
+        and, for the candidates only:
+            - missiles none of our loaded weapons can intercept before they reach their primary target
 
-        SHOVE MISSILES THAT CANNOT HIT ASSETS IN TIME TO BLACKLIST
-        
-        @param threat_data_lists: list of lists of size 30 for max number of missiles
-        For every target we want to filter out, we'll filter out that index
-        on ALL lists in 
+        @param snapshot: the current StatePb decoded into arrays
 
-        @return list of indices in accordance with one of our lists in our 
-        `threat_data_lists` that are not assigned and could reach at least one ship 
-        during the simulation
+        @return (threats, candidates) arrays of indices into the snapshot's track arrays, the candidates
+        being the threats we can shoot down
         """
-        target_ids = threat_data_lists[0]
-        threat_trackIds = threat_data_lists[1]
-        threat_poss = threat_data_lists[2]
-        threat_velos = threat_data_lists[3]
-
-        #300 seconds is max amount of time to do everything
-        max_time = 300
-        #get current time
-        cur_time_remaining = max_time - msg.time
-        
-        to_ret = []
-
-        for i in range(len(target_ids)):
-            # assignment filter
-            if threat_trackIds[i] not in self.blacklist:
-                to_ret.append(i)
-            else:
-                # unreaching missile filter
-                # loop through all the assets and see if THIS
-                # target (index i) will reach any of the assets
-                for asset_pos in assetPos_lst:
-                    if utils.timeBtwnEnemyAndShip_with_tuples(threat_velos[i], threat_poss[i], asset_pos) < cur_time_remaining:
-                        to_ret.append(i)
-
-        return to_ret
+        # weapons that are reloading count, the plan looks further ahead than this StatePb
+        return snapshot.cull_tracks(self.blacklist, weapons=snapshot.ammo > 0)
 
              
         # for target in target_list:
@@ -0,0 +1,105 @@
+import asyncio
+import sys
+from time import perf_counter
+import zmq
+import zmq.asyncio
+from subscriber import Subscriber, peek_container
+from client_config import shared_context
+from latency import PARSE, DECODE
+
+# Alternative to Subscriber.startSubscriber that runs the whole client on one asyncio event loop:
+# receiving, dispatching to the AiManager handlers and publishing all happen on the loop thread,
+# so there is no receiver thread handing messages back and forth with the main thread.
+#
+# Usage (see main.py):
+#   context = shared_context(config, use_asyncio=True)
+#   publisher = Publisher(context=context, config=config)      # sends on the loop, PUB sends never block
+#   ...
+#   subscriber.registerSubscribers(ai_manager)
+#   AsyncRuntime(subscriber, context).run()
+#
+# AiManager handlers may stay plain functions or be declared "async def"; coroutine handlers are awaited.
+# Handlers run on the loop thread, CPU heavy work belongs on a worker the AiManager owns
+# (as GeneticClient's training updates do on AiManager.trainer),
+# and periodic jobs (checkpointing, metrics export, ...) can share the loop with
+#   runtime.add_background_task(some_coroutine_function)
+class AsyncRuntime:
+
+    # Constructor
+    def __init__(self, subscriber: Subscriber, context: zmq.asyncio.Context = None):
+        self.subscriber = subscriber
+        self.context = context if context is not None else shared_context(subscriber.config, use_asyncio=True)
+
+        self.background_functions = []  # coroutine functions started together with the receive loop
+        self.background_tasks = set()
+        self.loop = None
+
+    # Schedules coroutine_function() on the event loop, now if the runtime is running, otherwise at startup
+    def add_background_task(self, coroutine_function):
+        if self.loop is None:
+            self.background_functions.append(coroutine_function)
+        else:
+            self.start_task(coroutine_function())
+
+    def start_task(self, coroutine):
+        task = self.loop.create_task(coroutine)
+        # Keep a reference until it is done, the loop itself only holds weak references to tasks
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    # Starts the event loop and blocks until the client is interrupted
+    def run(self):
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            print("Process terminated...")
+            sys.exit()
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        for coroutine_function in self.background_functions:
+            self.start_task(coroutine_function())
+
+        socket = self.subscriber.config.state_socket(self.context)
+
+        try:
+            await self.recvloop(socket)
+        finally:
+            for task in list(self.background_tasks):
+                task.cancel()
+            socket.close()
+            self.loop = None
+
+    # Receives messages from the Planner and passes them to related functions in AiManager
+    async def recvloop(self, socket):
+        while True:
+            msg = await socket.recv()
+            received = perf_counter()
+            msgType, payload = peek_container(msg)
+
+            if msgType in self.subscriber.dispatch_table:
+                await self.dispatch(msgType, msg[payload[0]:payload[1]], perf_counter() - received)
+
+    # Same as Subscriber.dispatch, but awaits handlers declared with "async def"
+    async def dispatch(self, msgType, payload, parse_time=0.0):
+        msg_class, handlers = self.subscriber.dispatch_table[msgType]
+        latency = self.subscriber.latency if msgType == "StatePb" else None
+
+        start = perf_counter()
+        unpacked = msg_class.FromString(payload)
+        decoded = perf_counter()
+        if latency is not None:
+            latency.start_tick()
+            latency.record(PARSE, parse_time)
+            latency.record(DECODE, decoded - start)
+
+        for handler in handlers:
+            result = handler(unpacked)
+            if asyncio.iscoroutine(result):
+                await result
+
+        if latency is not None:
+            done = perf_counter()
+            latency.end_tick(done - decoded, parse_time + done - start)
+        elif self.subscriber.latency is not None and msgType == "ScenarioConcludedNotificationPb":
+            self.subscriber.latency.report()
@@ -6,19 +6,45 @@
 from publisher import Publisher
 from subscriber import Subscriber
 from AiManager import AiManager
+from async_runtime import AsyncRuntime
+from client_config import ClientConfig, shared_context
+from latency import LatencyRecorder
+import os
+import utils
+
+# Set to True to run receiving, AI handlers and publishing on a single asyncio event loop
+ASYNC_RUNTIME = False
+
+# Set to True to time every StatePb -> OutputPb tick and print per stage percentiles at the end of each run
+MEASURE_LATENCY = False
+
+# JSON file overriding some of utils.SCORE_WEIGHTS, loaded at startup if it exists
+SCORE_WEIGHTS_FILE = "score_weights.json"
 
 if __name__ == '__main__':
     print("Initializing AI client\nGREEDY")
     
+    # Endpoints and socket tuning, one zmq context is shared by every socket
+    config = ClientConfig()
+    context = shared_context(config, use_asyncio=ASYNC_RUNTIME)
+    latency = LatencyRecorder() if MEASURE_LATENCY else None
+
+    if os.path.exists(SCORE_WEIGHTS_FILE):
+        utils.load_score_weights(SCORE_WEIGHTS_FILE)
+        print(f"Loaded score weights from {SCORE_WEIGHTS_FILE}")
+
     #Initialize Publisher
-    publisher = Publisher()
+    publisher = Publisher(context=context, config=config, latency=latency)
 
     #Initialize Subscriber
-    subscriber = Subscriber()
+    subscriber = Subscriber(config=config, latency=latency)
 
     #Initialize AiManager
     ai_manager = AiManager(publisher)
 
     #Register subscriber functions of Ai manager and begin listening for messages
     subscriber.registerSubscribers(ai_manager)
-    subscriber.startSubscriber()
\ No newline at end of file
+    if ASYNC_RUNTIME:
+        AsyncRuntime(subscriber, context).run()
+    else:
+        subscriber.startSubscriber()
\ No newline at end of file
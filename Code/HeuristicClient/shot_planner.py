@@ -0,0 +1,207 @@
+from time import perf_counter
+import utils
+
+# Number of search nodes expanded between looks at the clock
+DEADLINE_CHECK_INTERVAL = 32
+
+
+class ShotPlanner:
+    """
+    Branch and bound search for the k threats to shoot next, i.e. the ones whose removal leaves the remaining
+    threats with the lowest expected penalty (see penalty).
+
+    Threats with the same primary target, secondary target and reach_2nd cost us exactly the same, so a plan
+    only has to say how many threats of each such class get shot; within a class the ones that hit first go
+    first. A search state is the number of threats shot per class, which also fixes how many hits every ship
+    still takes, and every state is expanded at most once however many shot sequences lead to it.
+
+    A state is pruned when a lower bound on the penalty of anything reachable from it is no better than the
+    best plan found so far. The bound assumes the remaining shots could be spent at once on everything:
+    ships are only counted as destroyed if they would still be with as many of their attackers shot as there
+    are shots left, every threat is valued at its expected_value_new under that assumption, and the most
+    valuable shootable threats are dropped.
+    """
+
+    def __init__(self, threats, candidates, threat_info):
+        """
+        @param threats: indices of every threat still in play
+        @param candidates: indices of the threats we can shoot down, in tiebreak order
+        @param threat_info: per threat index: its primary target, its secondary target (None if there is none)
+        and whether it can reach it; per asset index: isHVU and health
+        """
+        primary, secondary, reach_2nd, asset_HVU, asset_health = threat_info
+        self.asset_health = asset_health
+
+        # per class: primary and secondary target (None if there is none), reach_2nd, number of threats,
+        # the candidates in it in the order they get shot and expected_value_new by [kill_1st][kill_2nd]
+        self.primary, self.secondary, self.reach = [], [], []
+        self.threats, self.members, self.values = [], [], []
+
+        class_index = {}
+        candidate_set = set(candidates)
+        self.tiebreak = {t: position for position, t in enumerate(candidates)}
+        for t in list(candidates) + [t for t in threats if t not in candidate_set]:
+            key = (primary[t], secondary[t], reach_2nd[t] and secondary[t] is not None)
+            if key not in class_index:
+                p, s, reach = key
+                class_index[key] = len(self.threats)
+                self.primary.append(p)
+                self.secondary.append(s)
+                self.reach.append(reach)
+                self.threats.append(0)
+                self.members.append([])
+                secondary_HVU = s is not None and asset_HVU[s]
+                self.values.append([[utils.expected_value_new(asset_HVU[p], secondary_HVU, kill_1st, kill_2nd, reach)
+                                     for kill_2nd in (False, True)] for kill_1st in (False, True)])
+
+            c = class_index[key]
+            self.threats[c] += 1
+            if t in candidate_set:
+                self.members[c].append(t)
+
+        self.penalties = {}  # shot counts per class -> penalty of the threats left
+        self.expanded = set()
+        self.best_shots, self.best_penalty = None, float('inf')
+        self.nodes = 0
+        self.deadline = None
+        self.timed_out = False  # the search stopped at the deadline, the plan may not be the optimal one
+        self.dive = ()  # deepest state of the first descent, the plan if not even one full plan was found
+
+    def search(self, max_shots, deadline):
+        """
+        Finds the max_shots threats to shoot, or the best plan found when the deadline passes.
+
+        @param max_shots: number of threats to shoot, at most the number of candidates
+        @param deadline: perf_counter() value at which the search has to stop
+        @return tuple of threat indices in tiebreak order, empty if there is nothing to shoot
+        """
+        self.deadline = deadline
+        start = tuple(0 for _ in self.threats)
+        if max_shots > 0:
+            self.expand(start, max_shots)
+
+        shots = self.best_shots if self.best_shots is not None else self.dive
+        return self.plan(shots)
+
+    # threats shot by a state, in tiebreak order
+    def plan(self, shots):
+        return tuple(sorted((t for c, count in enumerate(shots) for t in self.members[c][:count]),
+                            key=self.tiebreak.get))
+
+    def expand(self, shots, shots_left):
+        self.nodes += 1
+        if self.nodes % DEADLINE_CHECK_INTERVAL == 0 and perf_counter() > self.deadline:
+            self.timed_out = True
+        if self.timed_out:
+            return
+
+        if shots_left == 0:
+            penalty = self.penalty(shots)
+            if penalty < self.best_penalty:
+                self.best_shots, self.best_penalty = shots, penalty
+            return
+
+        if self.best_shots is None and sum(shots) > sum(self.dive):
+            self.dive = shots
+
+        # most promising shot first, so the first descent is the greedy plan
+        children = []
+        for c, count in enumerate(shots):
+            if count < len(self.members[c]):
+                child = shots[:c] + (count + 1,) + shots[c + 1:]
+                if child not in self.expanded:
+                    children.append((self.penalty(child), c, child))
+        children.sort()
+
+        for _, _, child in children:
+            if child in self.expanded:
+                continue
+            self.expanded.add(child)
+            if self.lower_bound(child, shots_left - 1) >= self.best_penalty:
+                continue
+            self.expand(child, shots_left - 1)
+            if self.timed_out:
+                return
+
+    def penalty(self, shots):
+        """
+        Expected penalty of the threats left after the given shots, memoized per state: the summed
+        utils.expected_value_new (the SCORE_TABLE entry at utils.score_index) of every threat left, where a ship
+        is destroyed once as many threats as its health target it, and threats aimed at a ship that is destroyed
+        anyway count towards their secondary target if they can reach it.
+
+        @param shots: number of threats shot per class
+        @return summed expected_value_new of the threats left
+        """
+        penalty = self.penalties.get(shots)
+        if penalty is None:
+            left = [n - shot for n, shot in zip(self.threats, shots)]
+            penalty = self.valuation(left, self.kills(left, left, 0))
+            self.penalties[shots] = penalty
+        return penalty
+
+    def lower_bound(self, shots, shots_left):
+        """
+        Lowest penalty any plan with shots_left more shots could reach from this state.
+
+        @param shots: number of threats shot per class
+        @param shots_left: shots still to be taken
+        @return a penalty no plan from this state can beat
+        """
+        if shots_left == 0:
+            return self.penalty(shots)
+
+        left = [n - shot for n, shot in zip(self.threats, shots)]
+        shootable = [len(members) - shot for members, shot in zip(self.members, shots)]
+        kill_1st, kill_2nd = self.kills(left, shootable, shots_left)
+
+        # value of every threat left with only the kills that happen regardless, minus the best shots
+        values = [self.values[c][kill_1st[self.primary[c]]][self.secondary[c] is not None and kill_2nd[self.secondary[c]]]
+                  for c in range(len(left))]
+        bound = sum(value * count for value, count in zip(values, left))
+        for value, count in sorted(zip(values, shootable), reverse=True):
+            take = min(count, shots_left)
+            bound -= value * take
+            shots_left -= take
+            if shots_left == 0:
+                break
+        return bound
+
+    def kills(self, left, shootable, shots_left):
+        """
+        Which ships get destroyed by their primary attackers (kill_1st) and by all of their attackers
+        including retargeting ones (kill_2nd), if up to shots_left more of the shootable threats are shot.
+        With shots_left = 0 this is the exact outcome for the threats left.
+
+        @param left: threats left per class
+        @param shootable: candidates left per class
+        @param shots_left: shots still to be taken
+        @return (kill_1st, kill_2nd) lists of booleans per asset
+        """
+        health = self.asset_health
+        targeting = [0] * len(health)
+        removable = [0] * len(health)
+        for c, p in enumerate(self.primary):
+            targeting[p] += left[c]
+            removable[p] += shootable[c]
+        certain = [targeting[a] - min(shots_left, removable[a]) for a in range(len(health))]
+        kill_1st = [certain[a] >= health[a] for a in range(len(health))]
+
+        retargeting = [0] * len(health)
+        removable = [0] * len(health)
+        for c, p in enumerate(self.primary):
+            if self.reach[c] and kill_1st[p]:
+                retargeting[self.secondary[c]] += left[c]
+                removable[self.secondary[c]] += shootable[c]
+        kill_2nd = [certain[a] + max(0, retargeting[a] - min(shots_left, removable[a])) >= health[a]
+                    for a in range(len(health))]
+        return kill_1st, kill_2nd
+
+    def valuation(self, left, kills):
+        kill_1st, kill_2nd = kills
+        total = 0
+        for c, count in enumerate(left):
+            if count:
+                s = self.secondary[c]
+                total += count * self.values[c][kill_1st[self.primary[c]]][s is not None and kill_2nd[s]]
+        return total
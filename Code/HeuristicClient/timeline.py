@@ -0,0 +1,126 @@
+import numpy as np
+from state_snapshot import StateSnapshot, SCENARIO_LENGTH
+import utils
+
+
+class DestructionTimeline:
+    """
+    Forward simulation of what the threats do to our ships if some of them get shot down, for many candidate
+    shot sets at once.
+
+    Every threat flies straight at its primary target. A ship is destroyed by the health-th missile to reach it,
+    missiles that would arrive after that retarget to their secondary target if they can reach it and are
+    wasted otherwise. Retargeting missiles can destroy their secondary target earlier than its own attackers
+    would, which makes more missiles retarget, so this is repeated until the destruction times settle.
+
+        timeline = DestructionTimeline(snapshot, threats)
+        destroyed, spilled, score = timeline.simulate(shot_sets)  # shot_sets: (sets, threats) bool
+    """
+
+    def __init__(self, snapshot: StateSnapshot, threats, reach_2nd=None):
+        """
+        @param snapshot: the current StatePb decoded into arrays
+        @param threats: indices into the snapshot's track arrays of the threats to simulate
+        @param reach_2nd: per threat, whether it can turn towards its secondary target,
+        by default the ones whose secondary target is outside of their turning radius
+        """
+        self.threats = np.asarray(threats, dtype=int)
+        self.score = snapshot.score
+        self.asset_positions = snapshot.asset_positions
+        self.health = snapshot.asset_health
+        self.HVU = snapshot.asset_HVU.astype(int)
+
+        # score lost per ship event, indexed by isHVU, from the weights expected_value_new uses
+        weights = utils.SCORE_WEIGHTS
+        self.hit_loss = np.array([weights["hit"], weights["hit_HVU"]], dtype=float)  # every missile that hits a ship
+        # on top of that, for the hit that destroys it
+        self.destroyed_loss = np.array([weights["kill"], weights["kill_HVU"]], dtype=float) - self.hit_loss
+
+        distance, _, time_to_impact = snapshot.impact_matrices()
+        primaries, secondaries = snapshot.target_assignment()
+        self.primary = primaries[self.threats]
+        self.secondary = secondaries[self.threats]
+        self.positions = snapshot.track_positions[self.threats]
+        self.velocities = snapshot.track_velocities[self.threats]
+        self.speed = np.linalg.norm(self.velocities, axis=1)
+
+        # arrival at the primary target, missiles still in the air at the end of the scenario do not count
+        self.time_left = SCENARIO_LENGTH - snapshot.time
+        self.arrival = time_to_impact[self.threats, self.primary]
+        self.arrival[self.arrival > self.time_left] = np.inf
+
+        if reach_2nd is None:
+            turning_radius = utils.turning_radius(self.velocities)
+            reach_2nd = turning_radius < distance[self.threats, np.maximum(self.secondary, 0)]
+        self.can_retarget = np.asarray(reach_2nd, dtype=bool) & (self.secondary >= 0)
+
+    def simulate(self, shot_sets):
+        """
+        @param shot_sets: (sets, threats) mask of the threats each candidate set shoots down
+        @return destroyed: (sets, assets) time from now at which each ship is destroyed, np.inf if it survives
+        @return spilled: (sets, threats) mask of the missiles that go on to their secondary target
+        @return score: (sets,) expected score at the end of the scenario
+        """
+        shot_sets = np.asarray(shot_sets, dtype=bool).reshape(-1, len(self.threats))
+        first = np.where(shot_sets, np.inf, self.arrival)  # (sets, threats)
+        primary = np.broadcast_to(self.primary, first.shape)
+        destroyed = self.destruction_times(first, primary)
+
+        hit_time, hit_target = first, primary
+        spilled = np.zeros(first.shape, dtype=bool)
+        for _ in range(len(self.health)):
+            primary_destroyed = np.take_along_axis(destroyed, primary, axis=1)
+            late = np.isfinite(first) & (first > primary_destroyed)
+            spilled = late & self.can_retarget
+            second = np.where(spilled, primary_destroyed + self.retarget_times(primary_destroyed), np.inf)
+
+            hit_time = np.where(late, second, first)
+            hit_target = np.where(spilled, self.secondary, self.primary)
+            hit_time[hit_time > self.time_left] = np.inf
+            settled = self.destruction_times(hit_time, hit_target)
+            if np.array_equal(settled, destroyed):
+                break
+            destroyed = settled
+
+        # a ship takes hits until it is destroyed, every later missile for it retargets or misses
+        hits = np.zeros(destroyed.shape)
+        landed = np.isfinite(hit_time) & (hit_time <= np.take_along_axis(destroyed, hit_target, axis=1))
+        np.add.at(hits, (np.nonzero(landed)[0], hit_target[landed]), 1)
+
+        # ships that are already destroyed are in snapshot.score, they only count as destroyed for the retargeting
+        newly_destroyed = np.isfinite(destroyed) & (self.health > 0)
+        loss = hits @ self.hit_loss[self.HVU] + newly_destroyed @ self.destroyed_loss[self.HVU]
+        return destroyed, spilled, self.score - loss
+
+    def destruction_times(self, hit_time, hit_target):
+        """
+        @param hit_time: (sets, threats) time each missile reaches its ship, np.inf if it never does
+        @param hit_target: (sets, threats) asset index of that ship
+        @return (sets, assets) time of the health-th hit on each ship, np.inf if it takes fewer hits,
+        0 for ships that are already destroyed
+        """
+        sets, threats = hit_time.shape
+        assets = np.arange(len(self.health))
+
+        # (sets, assets, threats + 1) hit times per ship in order, the last column stays inf for the ships
+        # that take fewer hits than their health
+        per_ship = np.full((sets, len(assets), threats + 1), np.inf)
+        per_ship[:, :, :threats] = np.where(hit_target[:, None, :] == assets[None, :, None], hit_time[:, None, :], np.inf)
+        per_ship.sort(axis=2)
+
+        needed = np.clip(self.health - 1, 0, threats)
+        destroyed = per_ship[:, assets, needed]
+        destroyed[:, self.health <= 0] = 0.0
+        return destroyed
+
+    def retarget_times(self, at):
+        """
+        @param at: (sets, threats) time at which each missile turns towards its secondary target
+        @return (sets, threats) time it then takes to get there, horizontal distance over speed like the
+        time_to_impact the primary arrivals come from
+        """
+        finite_at = np.where(np.isfinite(at), at, 0.0)
+        positions = self.positions[:, 0:2] + self.velocities[:, 0:2] * finite_at[:, :, None]  # (sets, threats, xy)
+        offsets = positions - self.asset_positions[np.maximum(self.secondary, 0), 0:2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.linalg.norm(offsets, axis=2) / self.speed
@@ -1,6 +1,8 @@
 from PlannerProto_pb2 import _TRACKPB, _ASSETPB, _WEAPONPB
 from random import choice
 from math import sqrt
+import json
+import numpy as np
 PI = 3.14159265
 TURNING_SPEED = 25
 
@@ -9,10 +11,10 @@ def distance(x1, y1, z1, x2, y2, z2):
 
 
 #Finds WHEN a given missile will reach its SECONDARY target if it exists
+#primary_target and secondary_target come from StateSnapshot.target_assignment(), secondary_target is None if there is none
 #Returns a number of seconds in the future
-def time_to_reach_secondary(missile: _TRACKPB, targeting_missiles, asset_list : list[_ASSETPB] ):
+def time_to_reach_secondary(missile: _TRACKPB, targeting_missiles, primary_target : _ASSETPB, secondary_target : _ASSETPB):
     #Calculate WHEN the primary target will be destroyed
-    primary_target = find_primary_target(missile,asset_list)
     #time to destruction
     ttd = when_ship_will_be_destroyed(primary_target,targeting_missiles)
     #Estimate WHERE our missile will be at this time
@@ -20,20 +22,20 @@ def time_to_reach_secondary(missile: _TRACKPB, targeting_missiles, asset_list :
     est_y = missile.PositionY + missile.VelocityY * ttd
     est_z = missile.PositionZ + missile.VelocityZ * ttd
     #Calculate WHEN missile will reach secondary target FROM this position IF it can reach it
-    secondary_target  = find_secondary_target(missile,asset_list)
     if secondary_target is None or not can_reach_secondary_target(missile,secondary_target):
         return 301
     missile_velocity = (missile.VelocityX ** 2 + missile.VelocityY ** 2 + missile.VelocityZ ** 2) ** (1/2)
-    return missile_velocity / distance(est_x,est_y,est_z, secondary_target.PositionX,secondary_target.PositionY,secondary_target.PositionY)
+    return ttd + distance(est_x,est_y,est_z, secondary_target.PositionX,secondary_target.PositionY,secondary_target.PositionZ) / missile_velocity
 
 #ship is the ship that will be destroyed
 #targeting_missiles is a list of the missiles that are targeting a given ship
+#Returns when the health-th missile to arrive hits it, 301 if there are not enough missiles
+#(timeline.DestructionTimeline does this for every ship and many shot sets at once)
 def when_ship_will_be_destroyed(ship, targeting_missiles):
-    def ttd(tm):
-        return time_between_missile_and_ship(tm,ship)
-    targeting_missiles.sort(reverse = True, key=ttd)
-    killing_missile = targeting_missiles[ship.health - 1]
-    return time_between_missile_and_ship(killing_missile,ship)
+    if len(targeting_missiles) < ship.health:
+        return 301
+    arrivals = sorted(time_between_missile_and_ship(tm,ship) for tm in targeting_missiles)
+    return arrivals[ship.health - 1]
     
 #Returns the TOTAL remaining ammo for our entire fleet
 #Argument: a list of our assets
@@ -102,6 +104,11 @@ def can_reach_secondary_target(missile: _TRACKPB, secondary_target : _ASSETPB):
     return turning_radius < distance_between_missile_and_ship(missile,secondary_target)
 
 
+#Array version of the radius in can_reach_secondary_target, for (n, 3) velocities
+def turning_radius(velocities):
+    return np.linalg.norm(velocities, axis=1) / (TURNING_SPEED * PI)
+
+
 #Arguments: the missile to be checked, a list of assets
 #Returns the PRIMARY target of this missile (if it redirects)
 def find_primary_target(missile: _TRACKPB, asset_list : list[_ASSETPB]):
@@ -122,7 +129,7 @@ def distance_between_missile_and_ship(missile : _TRACKPB, ship : _ASSETPB):
 def time_between_ships(defending_ship : _ASSETPB, target_ship : _ASSETPB, weapon_type : _WEAPONPB):
     distance_between_ships = distance(defending_ship.PositionX,defending_ship.PositionY,defending_ship.PositionZ, 
                                       target_ship.PositionX, target_ship.PositionY, target_ship.PositionZ)
-    if weapon_type.SystemName == "Chainshot":
+    if "Chainshot" in weapon_type.SystemName:
         weapon_speed = 1234
     else:
         weapon_speed = 3500
@@ -214,28 +221,85 @@ def expected_value(missile : _TRACKPB, target_dict, missile_target_dict):
     else:
         return 1000 + 10 / distance_between_missile_and_target
 
+#What a threat is expected to cost us, the weights of expected_value_new. They can be replaced at startup with
+#load_score_weights, every score is looked up in SCORE_TABLE which is built from them
+SCORE_WEIGHTS = {
+    "hit": 1000, "hit_HVU": 2000,       #missile reaches its primary target
+    "kill": 5000, "kill_HVU": 9000,     #instead: ...and the primary target gets destroyed
+    "reach_2nd": 500, "reach_2nd_HVU": 500,     #added after a kill: it goes on to its secondary target (an HVU one adds both)
+    "kill_2nd": 2500, "kill_2nd_HVU": 2000,     #instead: ...and destroys it
+}
+
+#Arguments: a SCORE_WEIGHTS dictionary
+#Returns the 32 entry table of expected_value_new, indexed by score_index
+def build_score_table(weights):
+    table = []
+    for index in range(32):
+        primary_HVU, secondary_HVU, kill_1st, kill_2nd, reach_2nd = [bool(index >> bit & 1) for bit in (4, 3, 2, 1, 0)]
+        if not kill_1st:
+            score = weights["hit_HVU"] if primary_HVU else weights["hit"]
+        else:
+            score = weights["kill_HVU"] if primary_HVU else weights["kill"]
+            if reach_2nd:
+                if not kill_2nd:
+                    score += weights["reach_2nd"]
+                    if secondary_HVU:
+                        score += weights["reach_2nd_HVU"]
+                else:
+                    score += weights["kill_2nd"]
+                    if secondary_HVU:
+                        score += weights["kill_2nd_HVU"]
+        table.append(score)
+    return np.array(table)
+
+SCORE_TABLE = build_score_table(SCORE_WEIGHTS)
+SCORE_LIST = SCORE_TABLE.tolist()   #the same as plain numbers, faster to index one at a time
+
+#Arguments: a table built by build_score_table
+#Returns a description of the first entry that breaks what ShotPlanner's lower bound relies on, None if there is none:
+#no threat may cost less than 0, and destroying its primary or secondary target may never make it cost less
+def score_table_problem(table):
+    names = ["primary_HVU", "secondary_HVU", "kill_1st", "kill_2nd", "reach_2nd"]
+    for index in range(32):
+        combination = ", ".join(name for bit, name in zip((4, 3, 2, 1, 0), names) if index >> bit & 1) or "nothing"
+        if table[index] < 0:
+            return f"the penalty with {combination} is negative ({table[index]})"
+        for bit, name in ((2, "kill_1st"), (1, "kill_2nd")):
+            if not index >> bit & 1 and table[index | 1 << bit] < table[index]:
+                return f"setting {name} lowers the penalty with {combination} from {table[index]} to {table[index | 1 << bit]}"
+    return None
+
+#Arguments: a JSON file with some or all of the SCORE_WEIGHTS keys
+#Replaces those weights and rebuilds the score table, unless they would make the search prune its best plan
+#(e.g. kill < hit): then a ValueError is raised and the current weights stay
+def load_score_weights(path):
+    global SCORE_TABLE, SCORE_LIST
+    with open(path) as file:
+        weights = json.load(file)
+    unknown = set(weights) - set(SCORE_WEIGHTS)
+    if unknown:
+        raise ValueError(f"Unknown score weights in {path}: {sorted(unknown)}")
+
+    merged = dict(SCORE_WEIGHTS, **weights)
+    table = build_score_table(merged)
+    problem = score_table_problem(table)
+    if problem is not None:
+        raise ValueError(f"Score weights in {path} cannot be used: {problem}. Every penalty has to be >= 0 and "
+                         f"destroying a ship may never lower it (kill >= hit >= 0, kill_HVU >= hit_HVU >= 0, "
+                         f"kill_2nd >= reach_2nd, kill_2nd + kill_2nd_HVU >= reach_2nd + reach_2nd_HVU)")
+    SCORE_WEIGHTS.update(merged)
+    SCORE_TABLE = table
+    SCORE_LIST = SCORE_TABLE.tolist()
+
+#Arguments: booleans, or boolean arrays of the same shape
+#Returns the SCORE_TABLE index (or index array) of that combination
+def score_index(primary_HVU, secondary_HVU, kill_1st, kill_2nd, reach_2nd):
+    return primary_HVU * 16 + secondary_HVU * 8 + kill_1st * 4 + kill_2nd * 2 + reach_2nd * 1
+
 def expected_value_new(primary_HVU, secondary_HVU, kill_1st, kill_2nd, reach_2nd):
-    score = 0
-    if not kill_1st:
-        score = 1000
-        if primary_HVU:
-            score = 2000
-    else:
-        score = 5000
-        if primary_HVU: 
-            score = 9000
-        if reach_2nd:
-            if not kill_2nd:
-                score += 500
-                if secondary_HVU:
-                    score += 500
-            else:
-                score += 2500
-                if secondary_HVU:
-                    score += 2000
-
-    return score
-    
+    return SCORE_LIST[score_index(bool(primary_HVU), bool(secondary_HVU), bool(kill_1st), bool(kill_2nd), bool(reach_2nd))]
+
+
         
 
 
@@ -6,8 +6,10 @@ from PlannerProto_pb2 import StatePb, AssetPb, TrackPb  # Simulation state infor
 from PlannerProto_pb2 import OutputPb, ShipActionPb, WeaponPb
 from publisher import Publisher
 
+import numpy as np
 import random
 import utils
+from threat_ranker import ThreatRanker, danger_levels
 
 # This class is the center of action for this example client.  Its has the required functionality 
 # to receive data from the Planner and send actions back.  Developed AIs can be written directly in here or
@@ -33,7 +35,7 @@ class AiManager:
     def __init__(self, publisher: Publisher):
         # print("Constructing AI Manager")
         self.ai_pub = publisher
-        self.track_danger_levels = None
+        self.threat_ranker = ThreatRanker() # unengaged tracks of the current StatePb by danger level
         self.blacklist = set()
         self.highest_distance = 0
 
@@ -59,6 +61,7 @@ class AiManager:
     # This method/message is used to nofify that a scenario/run has ended
     def receiveScenarioConcludedNotificationPb(self, msg: ScenarioConcludedNotificationPb):
         self.blacklist = set()
+        self.threat_ranker.reset()
         # print("Ended Run: " + str(msg.sessionId) + " with score: " + str(msg.score))
         # print(self.highest_distance)
 
@@ -107,31 +110,18 @@ class AiManager:
         TARGETING_CUTOFF = 0.2
         MAX_DANGER = 100
 
-        # list of (danger value, enemy missile info.) tuples
-        self.track_danger_levels = []
-
-        # assign a danger level for each incoming threat and have the threats sorted from most to least dangerous
+        # danger level of every unengaged hostile track, ranked by self.threat_ranker
         # Danger level is based on the summed distance to all of our assets
-        for track in msg.Tracks:
-            if track.ThreatRelationship == "Hostile" and track.TrackId not in self.blacklist:
-                # calculate danger value for current track
-                danger_metric = MAX_DANGER
-                for asset in msg.assets:
-                    danger_metric -= utils.distance(asset.PositionX, asset.PositionY, asset.PositionZ, track.PositionX,
-                                                    track.PositionY, track.PositionZ) / DANGER_DISTANCE_SCALE
-
-                # insert in sorted order
-                loc = 0
-                while loc < len(self.track_danger_levels) - 1 and danger_metric < self.track_danger_levels[0][0]:
-                    loc += 1
-                self.track_danger_levels.insert(loc, (danger_metric, track)) if loc < len(
-                    self.track_danger_levels) - 1 else self.track_danger_levels.append((danger_metric, track))
-
-        # # print(self.track_danger_levels)
+        hostile = {track.TrackId: track for track in msg.Tracks
+                   if track.ThreatRelationship == "Hostile" and track.TrackId not in self.blacklist}
+        track_positions = np.array([(track.PositionX, track.PositionY, track.PositionZ) for track in hostile.values()]).reshape(-1, 3)
+        asset_positions = np.array([(asset.PositionX, asset.PositionY, asset.PositionZ) for asset in msg.assets]).reshape(-1, 3)
+        dangers = danger_levels(track_positions, asset_positions, MAX_DANGER, DANGER_DISTANCE_SCALE)
+        self.threat_ranker.update_all(np.fromiter(hostile, dtype=np.int64, count=len(hostile)), dangers)
 
         # if there are any threat, and we have weapons
         # and the most dangerous threat value > MAX_DANGER * TARGETING_CUTOFF
-        if len(self.track_danger_levels) > 0 and self.weapons_are_available(msg.assets):
+        if len(self.threat_ranker) > 0 and self.weapons_are_available(msg.assets):
 
             # generate list of our defense ships that aren't targeting and have any weapons left
             unassigned_assets = []
@@ -143,7 +133,7 @@ class AiManager:
 
             # compare to the first asset
             s_ass = unassigned_assets[0]
-            most_danger_threat = self.track_danger_levels[0][1]
+            most_danger_threat = hostile[self.threat_ranker.top()[0]]
 
             s_dist = utils.distance(s_ass.PositionX, s_ass.PositionY, s_ass.PositionZ,
                                     most_danger_threat.PositionX, most_danger_threat.PositionY,
@@ -168,6 +158,7 @@ class AiManager:
             ship_action.AssetName = s_ass.AssetName
 
             self.blacklist.add(most_danger_threat.TrackId)
+            self.threat_ranker.remove(most_danger_threat.TrackId)
 
             # random weapon selection, but it may not be ready or there may not be any left
             rand_weapon = random.choice(s_ass.weapons)
@@ -0,0 +1,61 @@
+# Stages of a StatePb -> OutputPb tick, in pipeline order
+PARSE = 0  # reading the MsgContainerPb header
+DECODE = 1  # decoding the StatePb
+DECIDE = 2  # AiManager handlers, without the time spent publishing
+SERIALIZE = 3  # packing and serializing the OutputPb
+SEND = 4  # handing the bytes to zmq
+TOTAL = 5  # from the message being received until the handlers return
+STAGE_NAMES = ["parse", "decode", "decide", "serialize", "send", "total"]
+
+PERCENTILES = [50, 95, 99]
+
+
+# Records the duration of every stage of each tick into fixed size ring buffers, so recording never allocates.
+# The Subscriber (or AsyncRuntime) and the Publisher share one recorder:
+#   start_tick() -> record(stage, seconds)... -> end_tick(handler_seconds, total_seconds)
+# and report() prints percentiles per stage at the end of a scenario.
+class LatencyRecorder:
+
+    # Constructor
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.samples = [[0.0] * capacity for _ in STAGE_NAMES]
+        self.current = [0.0] * len(STAGE_NAMES)
+        self.ticks = 0  # ticks recorded since the last report, only the newest `capacity` are kept
+
+    def start_tick(self):
+        current = self.current
+        for stage in range(len(current)):
+            current[stage] = 0.0
+
+    # Adds seconds to a stage of the current tick
+    def record(self, stage: int, seconds: float):
+        self.current[stage] += seconds
+
+    # handler_seconds is the time spent in the AiManager handlers, including any publishing done from them
+    def end_tick(self, handler_seconds: float, total_seconds: float):
+        current = self.current
+        current[DECIDE] = handler_seconds - current[SERIALIZE] - current[SEND]
+        current[TOTAL] = total_seconds
+
+        slot = self.ticks % self.capacity
+        for stage in range(len(current)):
+            self.samples[stage][slot] = current[stage]
+        self.ticks += 1
+
+    # Returns {stage name: [p50, p95, p99]} in milliseconds over the recorded ticks
+    def percentiles(self):
+        count = min(self.ticks, self.capacity)
+        result = {}
+        for stage, name in enumerate(STAGE_NAMES):
+            ordered = sorted(self.samples[stage][:count])
+            result[name] = [1000 * ordered[round(p / 100 * (count - 1))] if count else 0.0 for p in PERCENTILES]
+        return result
+
+    # Prints the percentiles of every stage and starts over
+    def report(self):
+        print(f"Tick latency over the last {min(self.ticks, self.capacity)} of {self.ticks} ticks (ms):")
+        for name, values in self.percentiles().items():
+            print(f"  {name:<10}" + "".join(f"  p{p}: {value:8.3f}" for p, value in zip(PERCENTILES, values)))
+        self.ticks = 0
+
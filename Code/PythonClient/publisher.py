@@ -1,42 +1,52 @@
 # from google.protobuf import message, any_pb2
+from time import perf_counter
 import zmq
 
 from zmq.sugar.frame import Message
 import PlannerProto_pb2 as proto_messages
+from client_config import ClientConfig, DEFAULT_CONFIG, shared_context
+from latency import LatencyRecorder, SERIALIZE, SEND
 
 # Class to send messages to the Planner
 class Publisher:
     
     # Constructor
-    def __init__(self):
+    # Pass a zmq.asyncio.Context to publish from the asyncio runtime (see async_runtime.py),
+    # by default the process wide shared context is used
+    # Pass the Subscriber's LatencyRecorder to include serializing and sending in its tick measurements
+    def __init__(self, context: zmq.Context = None, config: ClientConfig = DEFAULT_CONFIG, latency: LatencyRecorder = None):
         # print("Constructing publisher")
         self.msgNum = 0
-        context = zmq.Context()
-        self.socket = context.socket(zmq.PUB)
-        self.socket.connect("tcp://127.0.0.1:8885")
+        if context is None:
+            context = shared_context(config)
+        self.socket = config.publish_socket(context)
+
+        # The container and its header are reused for every message instead of being rebuilt per publish
+        self.container:proto_messages.MsgContainerPb = proto_messages.MsgContainerPb()
+        self.header:proto_messages.MsgHeaderPb = self.container.Header
+
+        self.latency = latency
 
     # Puts message into proper protobuf container
+    # NOTE: the container is shared between calls, serialize it before packaging the next message
     def package(self, msg: Message):
         simpleName = type(msg).__name__
-        container:proto_messages.MsgContainerPb = proto_messages.MsgContainerPb()
-        header:proto_messages.MsgHeaderPb = container.Header
+        header = self.header
         header.Id = self.msgNum
         self.msgNum+=1
         header.ContentType = simpleName
-        any = container.Content.Pack(msg)
+        self.container.Content.Pack(msg)
         # print(f"Publishing {simpleName}")
-        return container
+        return self.container
 
     # Sends message to specified IP and port
     def publish(self, msg: Message):
-        container = self.package(msg)
-        bytes = container.SerializeToString()
-        self.socket.send(bytes)
-
-
-
-
-
-
-
-
+        start = perf_counter()
+        bytes = self.package(msg).SerializeToString()
+        serialized = perf_counter()
+        # copy=False hands the serialized buffer to zmq instead of copying it into a new frame
+        self.socket.send(bytes, copy=False)
+
+        if self.latency is not None:
+            self.latency.record(SERIALIZE, serialized - start)
+            self.latency.record(SEND, perf_counter() - serialized)
@@ -1,16 +1,30 @@
 import threading
-import zmq
+from collections import deque
 import sys
+from time import perf_counter
 import PlannerProto_pb2 as proto_messages
+from client_config import ClientConfig, DEFAULT_CONFIG, shared_context
+from latency import LatencyRecorder, PARSE, DECODE
 import AiManager
 
 # Class to handle subscriptions and/or receiving messages from the Planner 
 class Subscriber:
 
     # Constructor
-    def __init__(self):
+    def __init__(self, latest_state_only: bool = False, config: ClientConfig = DEFAULT_CONFIG,
+                 latency: LatencyRecorder = None):
         # print("Constructing subscriber")
         self.subscriber_functions = []
+        self.config = config
+
+        # If set, every StatePb tick is timed stage by stage (share the recorder with the Publisher)
+        self.latency = latency
+
+        # ContentType -> (proto message class, list of bound AiManager handlers)
+        self.dispatch_table = {}
+
+        # If set, receiving and AI compute run on separate threads and stale StatePbs are dropped
+        self.mailbox = StateMailbox() if latest_state_only else None
 
     # Determines functions of AiManager that subscribe to protomessages
     def registerSubscribers(self, ai_manager:AiManager):
@@ -23,6 +37,14 @@ class Subscriber:
         self.subscriber_functions = [method_name for method_name in dir(ai_manager)
                   if callable(getattr(ai_manager, method_name)) and method_name.__contains__("receive")]
         
+        # Build the dispatch table once so recvloop only needs a single lookup per message
+        self.dispatch_table = {}
+        for msg_type in proto_messages.DESCRIPTOR.message_types_by_name:
+            handlers = [getattr(ai_manager, function) for function in self.subscriber_functions
+                        if function.__contains__(msg_type)]
+            if handlers:
+                self.dispatch_table[msg_type] = (getattr(proto_messages, msg_type), handlers)
+
         # Print registered methods for user error checking
         # If you funciton isn't printed here it will not be called 
         # for function_name in self.subscriber_functions:
@@ -31,17 +53,21 @@ class Subscriber:
     # Starts TCP socket and main recieve loop
     def startSubscriber(self):
         event = threading.Event()
-        context = zmq.Context()
-        socket = context.socket(zmq.SUB)
-        socket.connect("tcp://127.0.0.1:8886")
-        socket.subscribe("")
+        socket = self.config.state_socket(shared_context(self.config))
 
         try:
-            t = threading.Thread(name="recvr-thread", target=self.recvloop, args=[socket, event])
-            t.start()
+            if self.mailbox is None:
+                threads = [threading.Thread(name="recvr-thread", target=self.recvloop, args=[socket, event])]
+            else:
+                threads = [threading.Thread(name="recvr-thread", target=self.recvloop_mailbox, args=[socket, event]),
+                           threading.Thread(name="compute-thread", target=self.computeloop, args=[event])]
+
+            for t in threads:
+                t.start()
 
-            while t.is_alive():
-                t.join(1)
+            while any(t.is_alive() for t in threads):
+                for t in threads:
+                    t.join(1)
         except KeyboardInterrupt:
             event.set()
             # print("Process terminated...")
@@ -52,21 +78,168 @@ class Subscriber:
         while not event.is_set():
             # print("Waiting to recv.")  
 
-            #  On each message recvd, deserialize the message bytes into a MsgContainerPb
+            #  On each message recvd, only read the header; the packed content is left untouched
+            #  unless an AiManager handler subscribes to its type
             msg = socket.recv()
-            serialized = proto_messages.MsgContainerPb()
-            serialized.ParseFromString(msg)
-
-            msgType = serialized.Header.ContentType
+            received = perf_counter()
+            msgType, payload = peek_container(msg)
             # print(f"Received a message of type: {msgType}")
 
-            if hasattr(proto_messages, msgType):
-                for function in self.subscriber_functions:
-                    if function.__contains__(msgType):
-                        unpacked = getattr(proto_messages, serialized.Header.ContentType)()
-                        serialized.Content.Unpack(unpacked)
-                        getattr(self.ai_manager, function)(unpacked)
+            if msgType in self.dispatch_table:
+                self.dispatch(msgType, msg[payload[0]:payload[1]], perf_counter() - received)
+
+    # Receiver half of latest_state_only mode: only reads the header and hands the message to the compute thread
+    def recvloop_mailbox(self, socket, event):
+        while not event.is_set():
+            msg = socket.recv()
+            received = perf_counter()
+            msgType, payload = peek_container(msg)
+
+            # Nobody would handle it anyway, don't bother the compute thread
+            if msgType in self.dispatch_table:
+                self.mailbox.put(msgType, msg[payload[0]:payload[1]], perf_counter() - received)
+
+    # Compute half of latest_state_only mode: runs the AiManager handlers on whatever the mailbox holds
+    def computeloop(self, event):
+        while not event.is_set():
+            item = self.mailbox.get(timeout=1)
+            if item is None:
+                continue
+
+            msgType, payload, parse_time = item
+            self.dispatch(msgType, payload, parse_time)
+
+            if msgType == "ScenarioConcludedNotificationPb":
+                print(f"Coalesced StatePb ticks this run: {self.mailbox.take_coalesced()} "
+                      f"(total: {self.mailbox.coalesced_total})")
+
+    # Decodes the packed content of a MsgContainerPb and passes it to every AiManager handler registered for its type
+    # parse_time is how long reading the header took, only used for latency measurements
+    def dispatch(self, msgType, payload, parse_time=0.0):
+        entry = self.dispatch_table.get(msgType)
+        if entry is None:
+            return
+
+        # Decode once, no matter how many handlers subscribe to this type
+        msg_class, handlers = entry
+        if self.latency is not None and msgType == "StatePb":
+            self.latency.start_tick()
+            self.latency.record(PARSE, parse_time)
+            start = perf_counter()
+            unpacked = msg_class.FromString(payload)
+            decoded = perf_counter()
+            for handler in handlers:
+                handler(unpacked)
+            done = perf_counter()
+            self.latency.record(DECODE, decoded - start)
+            self.latency.end_tick(done - decoded, parse_time + done - start)
+        else:
+            unpacked = msg_class.FromString(payload)
+            for handler in handlers:
+                handler(unpacked)
+
+        if self.latency is not None and msgType == "ScenarioConcludedNotificationPb":
+            self.latency.report()
+
+
+# Hands messages from the receiver thread to the compute thread.
+# StatePbs are coalesced so that only the latest unhandled one is kept ("latest state wins"),
+# every other message (scenario start/end notifications, ...) is queued and never dropped.
+class StateMailbox:
+
+    # Constructor
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = deque()  # (ContentType, packed content bytes, header parse time) in arrival order
+        self.coalesced = 0  # StatePbs replaced by a newer one since the last take_coalesced()
+        self.coalesced_total = 0
+
+    # Called by the receiver thread
+    def put(self, msg_type, payload, parse_time=0.0):
+        with self.condition:
+            if msg_type == "StatePb" and self.pending and self.pending[-1][0] == "StatePb":
+                # The compute thread has not picked up the previous tick yet, replace it
+                self.pending[-1] = (msg_type, payload, parse_time)
+                self.coalesced += 1
+                self.coalesced_total += 1
+            else:
+                self.pending.append((msg_type, payload, parse_time))
+            self.condition.notify()
+
+    # Called by the compute thread, returns None if nothing arrived within timeout seconds
+    def get(self, timeout=None):
+        with self.condition:
+            if not self.pending:
+                self.condition.wait(timeout)
+            if not self.pending:
+                return None
+            return self.pending.popleft()
+
+    # Returns the number of coalesced ticks since the last call and resets it
+    def take_coalesced(self):
+        with self.condition:
+            coalesced = self.coalesced
+            self.coalesced = 0
+            return coalesced
+
+
+# Protobuf wire types used by the Planner messages
+WIRETYPE_VARINT = 0
+WIRETYPE_FIXED64 = 1
+WIRETYPE_LENGTH_DELIMITED = 2
+WIRETYPE_FIXED32 = 5
+
+
+# Reads a base 128 varint starting at data[pos], returns (value, position after the varint)
+def read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
 
+# Yields (field number, start, end) of every length-delimited field in data[start:end], skipping all others
+def length_delimited_fields(data, start, end):
+    pos = start
+    while pos < end:
+        tag, pos = read_varint(data, pos)
+        wire_type = tag & 0x7
+        if wire_type == WIRETYPE_LENGTH_DELIMITED:
+            length, pos = read_varint(data, pos)
+            yield tag >> 3, pos, pos + length
+            pos += length
+        elif wire_type == WIRETYPE_VARINT:
+            _, pos = read_varint(data, pos)
+        elif wire_type == WIRETYPE_FIXED64:
+            pos += 8
+        elif wire_type == WIRETYPE_FIXED32:
+            pos += 4
+        else:
+            raise ValueError(f"Unexpected wire type {wire_type} in MsgContainerPb")
+    if pos != end:
+        raise ValueError("Truncated MsgContainerPb")
 
 
-            
+# Reads Header.ContentType of a serialized MsgContainerPb without building any proto objects.
+# Returns (ContentType, (start, end)) where data[start:end] is the still packed message inside Content.
+#   MsgContainerPb: Header = 1, Content = 2
+#   MsgHeaderPb:    ContentType = 4
+#   Any:            value = 2
+def peek_container(data):
+    msg_type = ""
+    payload = (0, 0)
+    for field, start, end in length_delimited_fields(data, 0, len(data)):
+        if field == 1:
+            for header_field, h_start, h_end in length_delimited_fields(data, start, end):
+                if header_field == 4:
+                    msg_type = data[h_start:h_end].decode("utf-8")
+        elif field == 2:
+            for any_field, a_start, a_end in length_delimited_fields(data, start, end):
+                if any_field == 2:
+                    payload = (a_start, a_end)
+    return msg_type, payload
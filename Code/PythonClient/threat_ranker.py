@@ -0,0 +1,59 @@
+import numpy as np
+
+
+# Returns the danger level of every track, higher is more dangerous: MAX_DANGER minus the summed squared distance
+# (utils.distance) to all of the given assets, scaled down by DANGER_DISTANCE_SCALE (see simple_greedy_strategy)
+def danger_levels(track_positions: np.ndarray, asset_positions: np.ndarray, max_danger: float, distance_scale: float):
+    offsets = track_positions[:, None, :] - asset_positions[None, :, :]
+    return max_danger - np.einsum('ijk,ijk->ij', offsets, offsets).sum(axis=1) / distance_scale
+
+
+# Ranks the tracks of the current tick by danger level:
+#   self.threat_ranker.update_all(track_ids, dangers)     # every StatePb, replaces the tracks of the last one
+#   track_id, danger = self.threat_ranker.top()           # most dangerous track, None if there is none
+#   self.threat_ranker.top_k(k)                           # the k most dangerous ones, most dangerous first
+#   self.threat_ranker.remove(track_id)                   # e.g. once it is engaged
+# Every track moves each tick, so nothing is kept between ticks: top_k selects with np.partition in O(n)
+# and only sorts the k tracks it returns. Ties are broken by the lower TrackId.
+class ThreatRanker:
+
+    # Constructor
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.track_ids = np.zeros(0, dtype=np.int64)
+        self.dangers = np.zeros(0)  # -inf for removed tracks
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def remove(self, track_id: int):
+        rows = np.flatnonzero((self.track_ids == track_id) & (self.dangers > -np.inf))
+        self.dangers[rows] = -np.inf
+        self.count -= len(rows)
+
+    # Sets the danger level of every track of this tick, tracks that are not among them are dropped
+    def update_all(self, track_ids, dangers):
+        self.track_ids = np.asarray(track_ids, dtype=np.int64)
+        self.dangers = np.array(dangers, dtype=float)
+        self.count = len(self.track_ids)
+
+    # (TrackId, danger) of the most dangerous track, None if there is none
+    def top(self):
+        ranked = self.top_k(1)
+        return ranked[0] if ranked else None
+
+    # [(TrackId, danger)] of the k most dangerous tracks, most dangerous first
+    def top_k(self, k: int):
+        k = min(k, self.count)
+        if k <= 0:
+            return []
+        rows = np.flatnonzero(self.dangers > -np.inf)
+        if k < len(rows):
+            # the k-th highest danger, every track tied with it is a candidate for the last places
+            cutoff = -np.partition(-self.dangers[rows], k - 1)[k - 1]
+            rows = rows[self.dangers[rows] >= cutoff]
+        rows = rows[np.lexsort((self.track_ids[rows], -self.dangers[rows]))[:k]]
+        return list(zip(self.track_ids[rows].tolist(), self.dangers[rows].tolist()))